@@ -4,30 +4,276 @@ import glob
 import logging
 import argparse
 import json
-import requests
+import shutil
+import asyncio
+import httpx
 from dotenv import load_dotenv
 
 # Add the project root to sys.path so we can import from src
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from src.midi_renderer import MidiRenderer
-from src.remaker import MusicRemaker
-from src.content_generator import ContentGenerator
-from src.video_uploader import VideoProducer
+# The service clients (FluidSynth, OpenAI, YouTube) are imported in main() after the --plan
+# branch so a dry run only loads the planner and remake routing
+from src.remaker import MusicRemaker, BACKENDS, POLICIES, DEFAULT_LOCAL_MODEL
+from src.audio_processor import AudioProcessor, CODECS
+from src.planner import PipelinePlanner, format_plan
+from src.memory import AsyncMemoryBudget, estimate_job_bytes, estimate_resident_bytes, parse_size
+from src.utils import async_download
+from src.compilation import compilation_metadata
+from src.upload_queue import UploadQueue, UploadScheduler, DEFAULT_DAILY_QUOTA
+from src.logging_config import setup_logging, log_context, update_log_context
+from src.timeouts import StageTimeout, run_stage, parse_stage_timeouts, HTTP_TIMEOUT
 
 # Load environment variables
 load_dotenv()
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        # logging.FileHandler("hymn_remaker.log") # Commented out to avoid permission issues if run in weird places
-    ]
-)
 logger = logging.getLogger("HymnRemaker")
 
+async def process_audio(midi_path, name_no_ext, args, renderer, remaker, audio_processor, http_client):
+    """
+    Render, remake and normalize one hymn.
+
+    Returns:
+        tuple: (final audio track path, lossless remake WAV path, normalization gain in dB)
+    """
+    filename = os.path.basename(midi_path)
+
+    # 1. Render MIDI to Audio (WAV)
+    update_log_context(stage="render")
+    base_audio_path = os.path.join(args.output_dir, f"{name_no_ext}_base.wav")
+    if not args.skip_render or not os.path.exists(base_audio_path):
+        await run_stage("render", renderer.arender(midi_path, base_audio_path), args.timeouts)
+    else:
+        logger.info("Skipping render for %s, %s exists.", filename, base_audio_path)
+
+    # 2. Generate Remake (MusicGen)
+    update_log_context(stage="remake")
+    remake_audio_path = os.path.join(args.output_dir, f"{name_no_ext}_remake.wav")
+
+    if not args.skip_remake or not os.path.exists(remake_audio_path):
+        # Call the routed backend (Replicate or local MusicGen)
+        remake_result = await run_stage("remake", remaker.aremake(base_audio_path, args.style), args.timeouts)
+
+        if remake_result.startswith(("http://", "https://")):
+            # Download the remake
+            update_log_context(stage="download")
+            logger.info("Downloading remake from %s...", remake_result)
+            await run_stage(
+                "download", async_download(remake_result, remake_audio_path, client=http_client), args.timeouts
+            )
+        else:
+            shutil.move(remake_result, remake_audio_path)
+    else:
+         logger.info("Skipping remake for %s, %s exists.", filename, remake_audio_path)
+
+    # 2b. Normalize loudness and encode the final audio track once
+    update_log_context(stage="normalize")
+    final_audio_path = os.path.join(args.output_dir, f"{name_no_ext}_final{audio_processor.extension}")
+    stats = await run_stage("normalize", audio_processor.aprocess(remake_audio_path, final_audio_path), args.timeouts)
+    return final_audio_path, remake_audio_path, stats["gain_db"]
+
+async def process_content(name_no_ext, args, content_gen):
+    """Generate metadata and album art for one hymn. Returns (metadata, art_url); art_url is None without track videos."""
+    # 3. Generate Content (Metadata & Art)
+    update_log_context(stage="metadata")
+    metadata = await run_stage("metadata", content_gen.agenerate_metadata(name_no_ext, style=args.style), args.timeouts)
+
+    art_url = None
+    if not args.skip_track_videos:
+        # The art is only the track video's still image; a compilation generates its own
+        update_log_context(stage="art")
+        art_prompt = f"Abstract album art for {metadata.get('title', name_no_ext)}, {args.style} style, high quality, 4k"
+        art_url = await run_stage("art", content_gen.agenerate_art(art_prompt), args.timeouts)
+
+    # Save metadata to file for reference
+    metadata_path = os.path.join(args.output_dir, f"{name_no_ext}_metadata.json")
+    with open(metadata_path, "w") as f:
+        json.dump(metadata, f, indent=4)
+    return metadata, art_url
+
+async def process_hymn(midi_path, args, renderer, remaker, audio_processor, content_gen, video_producer, http_client,
+                       uploader=None):
+    """
+    Run every pipeline stage for one MIDI file. Errors are logged, not raised.
+
+    Returns:
+        dict: {"name", "status"} plus "audio_path", "source_path" (the lossless remake),
+              "gain_db" and "metadata" when status is "ok",
+              or "error" (and "stage" for timeouts) when it is "failed" or "timeout".
+    """
+    filename = os.path.basename(midi_path)
+    name_no_ext = os.path.splitext(filename)[0]
+
+    with log_context(hymn=name_no_ext):
+        try:
+            logger.info("Processing %s...", filename)
+
+            # The audio chain and the content chain are independent, so they run concurrently.
+            # Each runs in its own task, so their stage context updates don't collide.
+            audio_task = asyncio.ensure_future(
+                process_audio(midi_path, name_no_ext, args, renderer, remaker, audio_processor, http_client)
+            )
+            content_task = asyncio.ensure_future(process_content(name_no_ext, args, content_gen))
+            try:
+                (final_audio_path, source_path, gain_db), (metadata, art_url) = await asyncio.gather(
+                    audio_task, content_task
+                )
+            except BaseException:
+                # Don't keep paying for the other chain once this hymn has failed, and wait for its
+                # cleanup (killed processes, cancelled predictions) before the slot is released
+                audio_task.cancel()
+                content_task.cancel()
+                await asyncio.gather(audio_task, content_task, return_exceptions=True)
+                raise
+
+            if not args.skip_track_videos:
+                # 4. Create Video
+                update_log_context(stage="video")
+                video_path = os.path.join(args.output_dir, f"{name_no_ext}.mp4")
+                await run_stage(
+                    "video",
+                    video_producer.acreate_video(final_audio_path, art_url, video_path, copy_audio=True, http_client=http_client),
+                    args.timeouts
+                )
+
+                # 5. Queue for YouTube upload (Optional); the scheduler uploads while later hymns generate
+                if uploader:
+                    uploader.submit(video_path, metadata, priority=args.upload_priority)
+
+            update_log_context(stage="done")
+            logger.info("Finished processing %s", filename)
+            return {"name": name_no_ext, "status": "ok", "audio_path": final_audio_path, "source_path": source_path,
+                    "gain_db": gain_db, "metadata": metadata}
+
+        except StageTimeout as e:
+            # The stage was cancelled (child processes killed, predictions cancelled) and the slot is freed
+            logger.error("Timed out processing %s: %s", midi_path, e)
+            return {"name": name_no_ext, "status": "timeout", "stage": e.stage, "error": str(e)}
+        except Exception as e:
+            logger.error("Error processing %s: %s", midi_path, e)
+            return {"name": name_no_ext, "status": "failed", "error": str(e)}
+
+async def build_compilation(results, args, content_gen, video_producer, http_client, uploader=None):
+    """Join every successfully processed hymn into one chaptered compilation video."""
+    with log_context(hymn="compilation", stage="compilation"):
+        # Join the lossless remakes with each track's normalization gain rather than the
+        # lossy final tracks, so the compilation's audio is encoded only once
+        tracks = [
+            {"audio_path": r["source_path"], "gain_db": r["gain_db"], "title": r["metadata"].get("title", r["name"])}
+            for r in results
+        ]
+        if not tracks:
+            logger.warning("No hymns were processed successfully; skipping compilation.")
+            return
+
+        try:
+            art_url = await run_stage("art", content_gen.agenerate_art(
+                f"Abstract album art for {args.compilation_title}, {args.style} style, high quality, 4k"
+            ), args.timeouts)
+            chapters = await run_stage("compilation", video_producer.acreate_compilation(
+                tracks, art_url, args.compilation,
+                crossfade=args.crossfade,
+                title=args.compilation_title,
+                sample_rate=args.sample_rate,
+                http_client=http_client
+            ), args.timeouts)
+        except StageTimeout as e:
+            logger.error("Timed out building the compilation: %s", e)
+            return
+        except Exception as e:
+            # The per-hymn results are already on disk; don't let the compilation take the run down
+            logger.error("Error building the compilation: %s", e)
+            return
+
+        metadata = compilation_metadata(args.compilation_title, chapters, [r["metadata"] for r in results])
+        metadata_path = os.path.splitext(args.compilation)[0] + "_metadata.json"
+        with open(metadata_path, "w") as f:
+            json.dump(metadata, f, indent=4)
+
+        if uploader:
+            uploader.submit(args.compilation, metadata, priority=args.upload_priority)
+
+def make_upload_scheduler(args, video_producer):
+    """Open the persistent upload queue for this output directory."""
+    queue = UploadQueue(
+        args.upload_queue or os.path.join(args.output_dir, "upload_queue.json"),
+        daily_quota=args.daily_quota
+    )
+    return UploadScheduler(queue, video_producer, wait_for_reset=args.wait_for_quota, timeouts=args.timeouts)
+
+def log_upload_stats(stats):
+    logger.info("Uploads: %d uploaded, %d failed, %d timed out, %d deferred",
+                stats["uploaded"], stats["failed"], stats["timed_out"], stats["deferred"])
+
+async def drain_uploads(args, video_producer):
+    """Upload whatever is left in the queue from earlier runs, as far as today's quota allows."""
+    scheduler = make_upload_scheduler(args, video_producer)
+    scheduler.close()
+    stats = await scheduler.run()
+    log_upload_stats(stats)
+
+async def run_pipeline(midi_files, args, renderer, remaker, audio_processor, content_gen, video_producer):
+    """Drive all hymns on one event loop, bounded by --jobs and the --max-memory budget."""
+    max_bytes = parse_size(args.max_memory) if args.max_memory else None
+    if max_bytes is not None:
+        # Model weights are loaded once and shared, so they come off the top of the budget
+        resident = estimate_resident_bytes(remaker.backends)
+        if resident >= max_bytes:
+            logger.warning("--max-memory %s is below the ~%d MiB of model weights; hymns will run one at a time.",
+                           args.max_memory, resident // (1024 * 1024))
+        max_bytes = max(0, max_bytes - resident)
+    budget = AsyncMemoryBudget(max_bytes)
+    slots = asyncio.Semaphore(args.jobs)
+
+    # Uploads run as one background task, so they overlap with generation and never
+    # hold a hymn's slot while they wait for quota
+    uploader = make_upload_scheduler(args, video_producer) if args.upload else None
+    upload_task = asyncio.ensure_future(uploader.run()) if uploader else None
+
+    # Socket-level timeout per connect/read; whole downloads are bounded by the "download" stage deadline
+    async with httpx.AsyncClient(follow_redirects=True, timeout=HTTP_TIMEOUT) as http_client:
+        async def run_one(midi_path):
+            name_no_ext = os.path.splitext(os.path.basename(midi_path))[0]
+            job_bytes = estimate_job_bytes(
+                audio_processor,
+                backends=remaker.backends,
+                base_wav_path=os.path.join(args.output_dir, f"{name_no_ext}_base.wav")
+            )
+            # A job only starts once it has a slot and its buffers fit the budget
+            async with slots, budget.reserve(job_bytes):
+                return await process_hymn(
+                    midi_path, args, renderer, remaker, audio_processor, content_gen, video_producer, http_client,
+                    uploader=uploader
+                )
+
+        try:
+            results = await asyncio.gather(*(run_one(midi_path) for midi_path in midi_files))
+
+            counts = {status: sum(r["status"] == status for r in results) for status in ("ok", "failed", "timeout")}
+            logger.info("Hymns: %d ok, %d failed, %d timed out", counts["ok"], counts["failed"], counts["timeout"])
+            for r in results:
+                if r["status"] == "timeout":
+                    logger.warning("%s timed out in stage %s", r["name"], r["stage"])
+
+            if args.compilation:
+                # gather keeps input order, so the tracklist follows the sorted MIDI file names
+                await build_compilation(
+                    [r for r in results if r["status"] == "ok"], args, content_gen, video_producer, http_client,
+                    uploader=uploader
+                )
+        except BaseException:
+            # Queued jobs are persisted, so a later run picks them up
+            if upload_task:
+                upload_task.cancel()
+            raise
+
+    if upload_task:
+        uploader.close()
+        stats = await upload_task
+        log_upload_stats(stats)
+
+    return results
+
 def main():
     parser = argparse.ArgumentParser(description="Hymn Remaker Pipeline")
     parser.add_argument("--input-dir", default="hymn_remaker/input", help="Directory containing input MIDI files")
@@ -37,85 +283,101 @@ def main():
     parser.add_argument("--upload", action="store_true", help="Upload to YouTube after generation")
     parser.add_argument("--skip-render", action="store_true", help="Skip MIDI rendering if WAV exists")
     parser.add_argument("--skip-remake", action="store_true", help="Skip music generation if output audio exists")
+    parser.add_argument("--remake-backends", default="replicate", help=f"Comma-separated remake backends in preference order ({', '.join(BACKENDS)})")
+    parser.add_argument("--remake-policy", choices=POLICIES, default="failover", help="How to choose between remake backends")
+    parser.add_argument("--local-model", default=DEFAULT_LOCAL_MODEL, help="Hugging Face MusicGen checkpoint for the local backend; only melody checkpoints follow the hymn's melody")
+    parser.add_argument("--max-remake-cost", type=float, help="Per-hymn cost cap in USD for the cost-capped policy")
+    parser.add_argument("--normalize", choices=["ebu", "peak"], default="ebu", help="Loudness normalization mode for the final audio")
+    parser.add_argument("--target-lufs", type=float, default=-14.0, help="Integrated loudness target in LUFS (ebu mode)")
+    parser.add_argument("--audio-codec", choices=list(CODECS), default="aac", help="Codec for the final audio track")
+    parser.add_argument("--sample-rate", type=int, default=48000, help="Sample rate of the final audio track")
+    parser.add_argument("--compilation", help="Also join all processed hymns into one chaptered compilation video at this path")
+    parser.add_argument("--compilation-title", default="Hymn Remix Compilation", help="Title of the compilation video")
+    parser.add_argument("--crossfade", type=float, default=3.0, help="Crossfade between compilation tracks in seconds (0 for hard cuts)")
+    parser.add_argument("--skip-track-videos", action="store_true", help="Don't create or upload a video per hymn (e.g. when only the compilation is wanted)")
+    parser.add_argument("--upload-queue", help="Persistent upload queue file (default: <output-dir>/upload_queue.json)")
+    parser.add_argument("--upload-priority", type=int, default=0, help="Priority of this run's uploads; higher goes first, ahead of older queued videos")
+    parser.add_argument("--daily-quota", type=int, default=DEFAULT_DAILY_QUOTA, help="YouTube Data API units available per day")
+    parser.add_argument("--wait-for-quota", action="store_true", help="When the quota runs out, keep running until it resets instead of leaving uploads queued")
+    parser.add_argument("--drain-uploads", action="store_true", help="Only upload videos already in the queue, then exit")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of hymns in flight at once on the event loop")
+    parser.add_argument("--max-memory", help="Budget for in-flight job buffers, e.g. 512M or 2G (default: unlimited)")
+    parser.add_argument("--timeout", action="append", metavar="STAGE=SECONDS", help="Override a stage deadline, e.g. remake=600; 'all=SECONDS' sets every stage and 0 disables (repeatable)")
+    parser.add_argument("--log-format", choices=["text", "json"], default="text", help="Log output format")
+    parser.add_argument("--log-level", default="INFO", help="Log level (DEBUG, INFO, WARNING, ...)")
+    parser.add_argument("--plan", action="store_true", help="Print the stages that would run and their estimated cost, then exit")
 
     args = parser.parse_args()
+    if args.jobs < 1:
+        # A zero-sized semaphore would leave every hymn waiting forever
+        parser.error("--jobs must be at least 1")
+
+    setup_logging(level=args.log_level.upper(), json_output=args.log_format == "json")
+
+    try:
+        args.timeouts = parse_stage_timeouts(args.timeout)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Validated here so a bad backend or policy is a usage error in --plan runs too
+    try:
+        remaker = MusicRemaker(
+            backends=[name.strip() for name in args.remake_backends.split(",")],
+            policy=args.remake_policy,
+            max_cost=args.max_remake_cost,
+            backend_options={"local": {"model_name": args.local_model}}
+        )
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.plan:
+        planner = PipelinePlanner(
+            args.output_dir,
+            skip_render=args.skip_render,
+            skip_remake=args.skip_remake,
+            upload=args.upload,
+            track_videos=not args.skip_track_videos,
+            remaker=remaker,
+            compilation=bool(args.compilation)
+        )
+        print(format_plan(planner.plan(sorted(glob.glob(os.path.join(args.input_dir, "*.mid"))))))
+        sys.exit(0)
+
+    from src.midi_renderer import MidiRenderer
+    from src.content_generator import ContentGenerator
+    from src.video_uploader import VideoProducer
 
     # Ensure output directory exists
     os.makedirs(args.output_dir, exist_ok=True)
 
+    if args.drain_uploads:
+        asyncio.run(drain_uploads(args, VideoProducer()))
+        sys.exit(0)
+
     # Initialize modules
     try:
         renderer = MidiRenderer(soundfont_path=args.soundfont)
-        remaker = MusicRemaker()
+        audio_processor = AudioProcessor(
+            mode=args.normalize,
+            target_lufs=args.target_lufs,
+            sample_rate=args.sample_rate,
+            codec=args.audio_codec
+        )
         content_gen = ContentGenerator()
         video_producer = VideoProducer()
     except Exception as e:
-        logger.error(f"Failed to initialize pipeline: {e}")
+        logger.error("Failed to initialize pipeline: %s", e)
         sys.exit(1)
 
     # Find MIDI files
-    midi_files = glob.glob(os.path.join(args.input_dir, "*.mid"))
+    midi_files = sorted(glob.glob(os.path.join(args.input_dir, "*.mid")))
     if not midi_files:
-        logger.warning(f"No MIDI files found in {args.input_dir}")
+        logger.warning("No MIDI files found in %s", args.input_dir)
         sys.exit(0)
 
-    logger.info(f"Found {len(midi_files)} MIDI files to process.")
+    logger.info("Found %d MIDI files to process.", len(midi_files))
 
-    for midi_path in midi_files:
-        try:
-            filename = os.path.basename(midi_path)
-            name_no_ext = os.path.splitext(filename)[0]
-            logger.info(f"Processing {filename}...")
-
-            # 1. Render MIDI to Audio (WAV)
-            base_audio_path = os.path.join(args.output_dir, f"{name_no_ext}_base.wav")
-            if not args.skip_render or not os.path.exists(base_audio_path):
-                renderer.render(midi_path, base_audio_path)
-            else:
-                logger.info(f"Skipping render for {filename}, {base_audio_path} exists.")
-
-            # 2. Generate Remake (MusicGen)
-            remake_audio_path = os.path.join(args.output_dir, f"{name_no_ext}_remake.wav")
-
-            if not args.skip_remake or not os.path.exists(remake_audio_path):
-                # Call Replicate
-                remake_url = remaker.remake(base_audio_path, args.style)
-
-                # Download the remake
-                logger.info(f"Downloading remake from {remake_url}...")
-                response = requests.get(remake_url)
-                response.raise_for_status()
-                with open(remake_audio_path, "wb") as f:
-                    f.write(response.content)
-            else:
-                 logger.info(f"Skipping remake for {filename}, {remake_audio_path} exists.")
-
-            # 3. Generate Content (Metadata & Art)
-            # We can do this in parallel, but sequential is safer for now
-            metadata = content_gen.generate_metadata(name_no_ext, style=args.style)
-
-            art_prompt = f"Abstract album art for {metadata.get('title', name_no_ext)}, {args.style} style, high quality, 4k"
-            art_url = content_gen.generate_art(art_prompt)
-
-            # Save metadata to file for reference
-            metadata_path = os.path.join(args.output_dir, f"{name_no_ext}_metadata.json")
-            with open(metadata_path, "w") as f:
-                json.dump(metadata, f, indent=4)
-
-            # 4. Create Video
-            video_path = os.path.join(args.output_dir, f"{name_no_ext}.mp4")
-            video_producer.create_video(remake_audio_path, art_url, video_path)
-
-            # 5. Upload to YouTube (Optional)
-            if args.upload:
-                video_id = video_producer.upload_to_youtube(video_path, metadata)
-                logger.info(f"Video uploaded: https://youtu.be/{video_id}")
-
-            logger.info(f"Finished processing {filename}")
-
-        except Exception as e:
-            logger.error(f"Error processing {midi_path}: {e}")
-            continue
+    asyncio.run(run_pipeline(midi_files, args, renderer, remaker, audio_processor, content_gen, video_producer))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,370 @@
+import os
+import math
+import asyncio
+import wave
+import subprocess
+import logging
+import numpy as np
+from .logging_config import truncate_output
+from .utils import kill_process
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg encoder arguments and container extension for each supported output codec
+CODECS = {
+    "aac": {"args": ["-c:a", "aac"], "extension": ".m4a"},
+    "opus": {"args": ["-c:a", "libopus"], "extension": ".ogg", "sample_rates": (8000, 12000, 16000, 24000, 48000)},
+}
+
+# EBU R128 / ITU-R BS.1770 gating constants
+BLOCK_SECONDS = 0.4
+STEP_SECONDS = 0.1
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+
+
+def k_weighting_coefficients(sample_rate):
+    """
+    Compute the two-stage K-weighting filter (BS.1770 pre-filter + RLB high-pass) for a sample rate.
+
+    Args:
+        sample_rate (int): Sample rate of the audio in Hz.
+
+    Returns:
+        list: [(b, a), (b, a)] biquad coefficients for the shelf and high-pass stages.
+    """
+    # High-shelf stage
+    f0 = 1681.974450955533
+    gain_db = 3.999843853973347
+    q = 0.7071752369554196
+    k = math.tan(math.pi * f0 / sample_rate)
+    vh = 10.0 ** (gain_db / 20.0)
+    vb = vh ** 0.4996667741545416
+    a0 = 1.0 + k / q + k * k
+    shelf_b = [(vh + vb * k / q + k * k) / a0, 2.0 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0]
+    shelf_a = [1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0]
+
+    # RLB high-pass stage
+    f0 = 38.13547087602444
+    q = 0.5003270373238773
+    k = math.tan(math.pi * f0 / sample_rate)
+    a0 = 1.0 + k / q + k * k
+    highpass_b = [1.0, -2.0, 1.0]
+    highpass_a = [1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0]
+
+    return [(np.array(shelf_b), np.array(shelf_a)), (np.array(highpass_b), np.array(highpass_a))]
+
+
+def read_wav_chunks(path, chunk_frames):
+    """
+    Stream a PCM WAV file as float32 chunks without loading it into memory.
+
+    Args:
+        path (str): Path to the WAV file.
+        chunk_frames (int): Number of frames per chunk.
+
+    Yields:
+        numpy.ndarray: Array of shape (frames, channels) scaled to [-1.0, 1.0).
+    """
+    with wave.open(path, "rb") as wav:
+        sample_width = wav.getsampwidth()
+        channels = wav.getnchannels()
+        while True:
+            raw = wav.readframes(chunk_frames)
+            if not raw:
+                break
+            yield _pcm_to_float(raw, sample_width).reshape(-1, channels)
+
+
+def _next_scaled_pcm(chunks, gain):
+    """Read the next chunk from read_wav_chunks and return it gained as f32le bytes, or None at the end."""
+    chunk = next(chunks, None)
+    if chunk is None:
+        return None
+    return (chunk * gain).astype("<f4").tobytes()
+
+
+def _pcm_to_float(raw, sample_width):
+    """Convert little-endian PCM bytes to float32 samples."""
+    if sample_width == 1:
+        # 8-bit WAV is unsigned
+        return (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    if sample_width == 2:
+        return np.frombuffer(raw, dtype="<i2").astype(np.float32) / 32768.0
+    if sample_width == 3:
+        # Pad each 24-bit sample to 32 bits in the high bytes so the sign is preserved
+        data = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((data.shape[0], 4), dtype=np.uint8)
+        padded[:, 1:] = data
+        return padded.view("<i4").reshape(-1).astype(np.float32) / 2147483648.0
+    if sample_width == 4:
+        return np.frombuffer(raw, dtype="<i4").astype(np.float32) / 2147483648.0
+    raise ValueError(f"Unsupported WAV sample width: {sample_width} bytes")
+
+
+class AudioProcessor:
+    def __init__(self, mode="ebu", target_lufs=-14.0, peak_ceiling_db=-1.0,
+                 sample_rate=48000, codec="aac", bitrate="192k", chunk_seconds=1.0):
+        """
+        Initialize the AudioProcessor that normalizes loudness and encodes the final audio track.
+
+        Args:
+            mode (str): "ebu" for EBU R128 integrated loudness, "peak" for sample peak normalization.
+            target_lufs (float): Integrated loudness target in LUFS (used in "ebu" mode).
+            peak_ceiling_db (float): Maximum sample peak in dBFS after gain is applied.
+            sample_rate (int): Output sample rate in Hz; the encoder resamples if it differs.
+            codec (str): Output codec, one of CODECS ("aac" or "opus").
+            bitrate (str): Encoder bitrate passed to ffmpeg.
+            chunk_seconds (float): Length of each streamed chunk in seconds.
+        """
+        if mode not in ("ebu", "peak"):
+            raise ValueError(f"Unknown normalization mode: {mode}")
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported codec: {codec}. Choose from {', '.join(CODECS)}.")
+        supported_rates = CODECS[codec].get("sample_rates")
+        if supported_rates and sample_rate not in supported_rates:
+            raise ValueError(
+                f"Codec {codec} does not support {sample_rate} Hz. Choose from {', '.join(map(str, supported_rates))}."
+            )
+
+        self.mode = mode
+        self.target_lufs = target_lufs
+        self.peak_ceiling_db = peak_ceiling_db
+        self.sample_rate = sample_rate
+        self.codec = codec
+        self.bitrate = bitrate
+        self.chunk_seconds = chunk_seconds
+
+    @property
+    def extension(self):
+        """Container extension for the configured codec (e.g. '.m4a')."""
+        return CODECS[self.codec]["extension"]
+
+    def buffer_bytes(self, sample_rate=48000, channels=2):
+        """
+        Estimate the peak memory held by one chunk while analyzing or encoding.
+
+        Args:
+            sample_rate (int): Sample rate of the input audio.
+            channels (int): Channel count of the input audio.
+
+        Returns:
+            int: Estimated bytes.
+        """
+        samples = int(self.chunk_seconds * sample_rate) * channels
+        # Raw PCM (up to 4 bytes) + float32 chunk + float64 copies for each filter stage and the squares
+        return samples * (4 + 4 + 8 * 3)
+
+    def analyze(self, audio_path):
+        """
+        Measure integrated loudness and sample peak of a WAV file in a single streaming pass.
+
+        Args:
+            audio_path (str): Path to the input WAV file.
+
+        Returns:
+            dict: {
+                "integrated_lufs": float (-inf for silence),
+                "peak_dbfs": float (-inf for silence)
+            }
+        """
+        # Imported here so loading the module (e.g. for CODECS in a --plan run) doesn't pull in scipy
+        from scipy.signal import lfilter, lfilter_zi
+
+        if not os.path.exists(audio_path):
+            raise FileNotFoundError(f"Input audio file not found: {audio_path}")
+
+        with wave.open(audio_path, "rb") as wav:
+            sample_rate = wav.getframerate()
+            channels = wav.getnchannels()
+
+        step_frames = int(round(STEP_SECONDS * sample_rate))
+        # Read whole gating steps so sub-block boundaries never straddle chunks
+        chunk_frames = max(1, int(round(self.chunk_seconds / STEP_SECONDS))) * step_frames
+
+        stages = k_weighting_coefficients(sample_rate)
+        # Filter state per stage, one column per channel
+        states = [np.outer(lfilter_zi(b, a), np.zeros(channels)) for b, a in stages]
+
+        peak = 0.0
+        step_energy = []
+        for chunk in read_wav_chunks(audio_path, chunk_frames):
+            peak = max(peak, float(np.max(np.abs(chunk))))
+
+            filtered = chunk.astype(np.float64)
+            for i, (b, a) in enumerate(stages):
+                filtered, states[i] = lfilter(b, a, filtered, axis=0, zi=states[i])
+
+            # Sum of squares per 100ms step, per channel; a trailing partial step is dropped
+            full_steps = filtered.shape[0] // step_frames
+            if full_steps:
+                squared = np.square(filtered[:full_steps * step_frames])
+                step_energy.append(squared.reshape(full_steps, step_frames, channels).sum(axis=1))
+
+        peak_dbfs = 20.0 * math.log10(peak) if peak > 0 else float("-inf")
+        integrated = self._gated_loudness(step_energy, step_frames)
+        logger.info("Analyzed %s: %.2f LUFS, peak %.2f dBFS", audio_path, integrated, peak_dbfs,
+                    extra={"integrated_lufs": integrated, "peak_dbfs": peak_dbfs})
+        return {"integrated_lufs": integrated, "peak_dbfs": peak_dbfs}
+
+    def _gated_loudness(self, step_energy, step_frames):
+        """Apply BS.1770 absolute and relative gating to per-step channel energies."""
+        steps_per_block = int(round(BLOCK_SECONDS / STEP_SECONDS))
+        if not step_energy:
+            return float("-inf")
+        energy = np.concatenate(step_energy)
+        if energy.shape[0] < steps_per_block:
+            return float("-inf")
+
+        # 400ms blocks with 75% overlap = rolling sum of four 100ms steps
+        cumulative = np.concatenate([np.zeros((1, energy.shape[1])), np.cumsum(energy, axis=0)])
+        block_energy = cumulative[steps_per_block:] - cumulative[:-steps_per_block]
+        block_power = block_energy / (steps_per_block * step_frames)
+        # All channel weights are 1.0 for mono/stereo material
+        summed = block_power.sum(axis=1)
+
+        with np.errstate(divide="ignore"):
+            block_loudness = -0.691 + 10.0 * np.log10(summed)
+
+        gated = summed[block_loudness > ABSOLUTE_GATE_LUFS]
+        if gated.size == 0:
+            return float("-inf")
+        relative_gate = -0.691 + 10.0 * math.log10(gated.mean()) + RELATIVE_GATE_LU
+        gated = summed[block_loudness > max(ABSOLUTE_GATE_LUFS, relative_gate)]
+        return -0.691 + 10.0 * math.log10(gated.mean())
+
+    def compute_gain(self, stats):
+        """
+        Compute the linear gain to apply for the configured mode, capped by the peak ceiling.
+
+        Args:
+            stats (dict): Result of analyze().
+
+        Returns:
+            float: Linear gain factor (1.0 for silent input).
+        """
+        if stats["peak_dbfs"] == float("-inf"):
+            return 1.0
+
+        ceiling_gain_db = self.peak_ceiling_db - stats["peak_dbfs"]
+        if self.mode == "ebu" and stats["integrated_lufs"] != float("-inf"):
+            gain_db = min(self.target_lufs - stats["integrated_lufs"], ceiling_gain_db)
+        else:
+            gain_db = ceiling_gain_db
+        return 10.0 ** (gain_db / 20.0)
+
+    def process(self, audio_path, output_path):
+        """
+        Normalize a WAV file and encode it once to the final codec, streaming chunks into ffmpeg.
+
+        Args:
+            audio_path (str): Path to the input WAV file.
+            output_path (str): Path to the encoded output (extension should match the codec).
+
+        Returns:
+            dict: Analysis stats plus the applied "gain_db".
+        """
+        stats, gain, sample_rate, channels = self._prepare(audio_path)
+        cmd = self._encode_command(sample_rate, channels, output_path)
+
+        logger.info("Encoding %s to %s (%s, gain %+.2f dB)...", audio_path, output_path, self.codec, stats["gain_db"])
+        chunk_frames = max(1, int(self.chunk_seconds * sample_rate))
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        try:
+            for chunk in read_wav_chunks(audio_path, chunk_frames):
+                process.stdin.write((chunk * gain).astype("<f4").tobytes())
+            process.stdin.close()
+            stderr = process.stderr.read()
+            process.wait()
+        except Exception:
+            process.kill()
+            process.wait()
+            raise
+
+        if process.returncode != 0:
+            logger.error("FFmpeg audio encode failed: %s", truncate_output(stderr))
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+
+        logger.info("Audio encoded at %s", output_path)
+        return stats
+
+    async def aprocess(self, audio_path, output_path):
+        """
+        Async variant of process. The loudness analysis, and each chunk's read and gain, run
+        in a worker thread; the encode streams into an asyncio ffmpeg subprocess, which is
+        killed if the stage is cancelled.
+        """
+        stats, gain, sample_rate, channels = await asyncio.to_thread(self._prepare, audio_path)
+        cmd = self._encode_command(sample_rate, channels, output_path)
+
+        logger.info("Encoding %s to %s (%s, gain %+.2f dB)...", audio_path, output_path, self.codec, stats["gain_db"])
+        chunk_frames = max(1, int(self.chunk_seconds * sample_rate))
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+        chunks = read_wav_chunks(audio_path, chunk_frames)
+        try:
+            while True:
+                pcm = await asyncio.to_thread(_next_scaled_pcm, chunks, gain)
+                if pcm is None:
+                    break
+                process.stdin.write(pcm)
+                await process.stdin.drain()
+            process.stdin.close()
+            stderr = await process.stderr.read()
+            await process.wait()
+        except BaseException:
+            kill_process(process)
+            await process.wait()
+            raise
+        finally:
+            try:
+                chunks.close()
+            except ValueError:
+                # Cancelled while a worker thread is still reading; the generator is closed when collected
+                pass
+
+        if process.returncode != 0:
+            logger.error("FFmpeg audio encode failed: %s", truncate_output(stderr))
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+
+        logger.info("Audio encoded at %s", output_path)
+        return stats
+
+    def _prepare(self, audio_path):
+        """Analyze a WAV file. Returns (stats with "gain_db", linear gain, sample rate, channels)."""
+        stats = self.analyze(audio_path)
+        gain = self.compute_gain(stats)
+        stats["gain_db"] = 20.0 * math.log10(gain)
+
+        with wave.open(audio_path, "rb") as wav:
+            return stats, gain, wav.getframerate(), wav.getnchannels()
+
+    def _encode_command(self, sample_rate, channels, output_path):
+        """Build the ffmpeg command that encodes f32le PCM from stdin to the final codec."""
+        return [
+            "ffmpeg",
+            "-y",
+            # Keep stderr small so the pipe never fills while we are writing stdin
+            "-hide_banner",
+            "-loglevel", "error",
+            "-f", "f32le",
+            "-ar", str(sample_rate),
+            "-ac", str(channels),
+            "-i", "pipe:0",
+            "-ar", str(self.sample_rate),
+            *CODECS[self.codec]["args"],
+            "-b:a", self.bitrate,
+            output_path
+        ]
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    import sys
+    if len(sys.argv) > 2:
+        processor = AudioProcessor()
+        print(processor.process(sys.argv[1], sys.argv[2]))
+    elif len(sys.argv) > 1:
+        print(AudioProcessor().analyze(sys.argv[1]))
+    else:
+        print("Usage: python audio_processor.py <input.wav> [output.m4a]")
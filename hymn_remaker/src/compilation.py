@@ -0,0 +1,192 @@
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+# YouTube only turns description timestamps into chapters with at least this many, each this long
+YOUTUBE_MIN_CHAPTERS = 3
+YOUTUBE_MIN_CHAPTER_SECONDS = 10
+
+# YouTube rejects tag lists longer than 500 characters in total
+MAX_TAGS_CHARS = 500
+
+
+def probe_duration(audio_path):
+    """
+    Return the duration of a media file in seconds using ffprobe.
+
+    Args:
+        audio_path (str): Path to the audio file.
+
+    Returns:
+        float: Duration in seconds.
+    """
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        audio_path
+    ]
+    result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return float(result.stdout.decode().strip())
+
+
+def compute_chapters(titles, durations, crossfade=0.0):
+    """
+    Lay tracks out on the compilation timeline.
+
+    Each crossfade overlaps consecutive tracks, so every chapter after the first starts
+    `crossfade` seconds before the previous track ends.
+
+    Args:
+        titles (list): Chapter title per track.
+        durations (list): Duration in seconds per track.
+        crossfade (float): Overlap between consecutive tracks in seconds.
+
+    Returns:
+        list: [{"title": str, "start": float, "end": float}, ...]
+    """
+    if len(titles) != len(durations):
+        raise ValueError("titles and durations must have the same length")
+    if durations and crossfade >= min(durations):
+        raise ValueError(f"Crossfade of {crossfade}s is longer than the shortest track ({min(durations):.1f}s)")
+
+    chapters = []
+    start = 0.0
+    for i, (title, duration) in enumerate(zip(titles, durations)):
+        end = start + duration
+        # The next chapter begins where the crossfade into it begins
+        chapter_end = end - crossfade if i < len(durations) - 1 else end
+        chapters.append({"title": title, "start": start, "end": chapter_end})
+        start = chapter_end
+    return chapters
+
+
+def format_timestamp(seconds, with_hours=False):
+    """Format seconds as M:SS / MM:SS, or H:MM:SS when with_hours is set."""
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, secs = divmod(remainder, 60)
+    if with_hours:
+        return f"{hours}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+
+def chapter_description(chapters):
+    """
+    Render chapters as YouTube description timestamps ("00:00 Title" per line).
+
+    Args:
+        chapters (list): Result of compute_chapters().
+
+    Returns:
+        str: One line per chapter.
+    """
+    if len(chapters) < YOUTUBE_MIN_CHAPTERS or any(c["end"] - c["start"] < YOUTUBE_MIN_CHAPTER_SECONDS for c in chapters):
+        logger.warning("YouTube needs at least %d chapters of %ds or more; timestamps will not become chapters.",
+                       YOUTUBE_MIN_CHAPTERS, YOUTUBE_MIN_CHAPTER_SECONDS)
+
+    with_hours = bool(chapters) and chapters[-1]["end"] >= 3600
+    return "\n".join(f"{format_timestamp(c['start'], with_hours)} {c['title']}" for c in chapters)
+
+
+def _escape_ffmetadata(value):
+    """Escape characters with special meaning in ffmpeg's FFMETADATA format."""
+    for char in ("\\", "=", ";", "#", "\n"):
+        value = value.replace(char, "\\" + char)
+    return value
+
+
+def ffmetadata_chapters(chapters, title=None):
+    """
+    Render chapters as an FFMETADATA file so they are embedded in the MP4.
+
+    Args:
+        chapters (list): Result of compute_chapters().
+        title (str): Optional container title.
+
+    Returns:
+        str: FFMETADATA file contents.
+    """
+    lines = [";FFMETADATA1"]
+    if title:
+        lines.append(f"title={_escape_ffmetadata(title)}")
+    for chapter in chapters:
+        lines.extend([
+            "[CHAPTER]",
+            "TIMEBASE=1/1000",
+            f"START={int(chapter['start'] * 1000)}",
+            f"END={int(chapter['end'] * 1000)}",
+            f"title={_escape_ffmetadata(chapter['title'])}",
+        ])
+    return "\n".join(lines) + "\n"
+
+
+def compilation_filter(count, crossfade=0.0, sample_rate=48000, gains_db=None):
+    """
+    Build the audio filter graph that joins `count` tracks (ffmpeg inputs 1..count).
+
+    Every input is first converted to a common format so tracks from different
+    backends (mono/stereo, different rates) can be joined.
+
+    Args:
+        count (int): Number of audio inputs.
+        crossfade (float): Crossfade duration in seconds; 0 concatenates back to back.
+        sample_rate (int): Output sample rate.
+        gains_db (list): Optional gain per input in dB, e.g. each track's loudness
+                         normalization gain when joining the unprocessed remakes.
+
+    Returns:
+        tuple: (filter_complex string, label of the output audio stream)
+    """
+    gains_db = gains_db or [0.0] * count
+    parts = [
+        f"[{i + 1}:a]aformat=sample_fmts=fltp:sample_rates={sample_rate}:channel_layouts=stereo"
+        + (f",volume={gains_db[i]:.2f}dB" if gains_db[i] else "")
+        + f"[a{i}]"
+        for i in range(count)
+    ]
+
+    if count == 1:
+        return parts[0], "a0"
+
+    if crossfade <= 0:
+        inputs = "".join(f"[a{i}]" for i in range(count))
+        parts.append(f"{inputs}concat=n={count}:v=0:a=1[aout]")
+        return ";".join(parts), "aout"
+
+    current = "a0"
+    for i in range(1, count):
+        output = f"x{i}"
+        parts.append(f"[{current}][a{i}]acrossfade=d={crossfade}:c1=tri:c2=tri[{output}]")
+        current = output
+    return ";".join(parts), current
+
+
+def compilation_metadata(title, chapters, track_metadata, intro=None):
+    """
+    Build upload metadata for a compilation from the per-track ContentGenerator metadata.
+
+    Args:
+        title (str): Compilation title.
+        chapters (list): Result of compute_chapters().
+        track_metadata (list): Metadata dict per track (title, description, tags).
+        intro (str): Optional paragraph shown above the tracklist.
+
+    Returns:
+        dict: {"title": str, "description": str, "tags": list}
+    """
+    description = f"{intro}\n\n" if intro else ""
+    description += "Tracklist:\n" + chapter_description(chapters)
+
+    tags = []
+    total = 0
+    for metadata in track_metadata:
+        for tag in metadata.get("tags", []):
+            if tag in tags or total + len(tag) > MAX_TAGS_CHARS:
+                continue
+            tags.append(tag)
+            total += len(tag)
+
+    return {"title": title, "description": description, "tags": tags}
@@ -2,9 +2,8 @@ import os
 import openai
 import logging
 import json
-from .utils import retry_request
+from .utils import retry_request, async_retry_request
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class ContentGenerator:
@@ -21,6 +20,35 @@ class ContentGenerator:
 
         if self.api_key:
             self.client = openai.OpenAI(api_key=self.api_key)
+            self.async_client = openai.AsyncOpenAI(api_key=self.api_key)
+
+    def _metadata_request(self, hymn_name, style):
+        """Build the chat completion arguments for generate_metadata."""
+        prompt = (
+            f"Generate metadata for a YouTube video featuring a {style} remake of the hymn '{hymn_name}'.\n"
+            f"Provide the following fields in JSON format:\n"
+            f"1. title: A catchy, modern title for the video.\n"
+            f"2. description: A compelling description (max 1000 chars) explaining the remake.\n"
+            f"3. tags: A list of 10 relevant tags."
+        )
+        return {
+            "model": "gpt-4-turbo",  # Using a model that supports JSON mode
+            "messages": [
+                {"role": "system", "content": "You are a creative content strategist for a music channel. You must respond in valid JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            "response_format": { "type": "json_object" }
+        }
+
+    def _art_request(self, prompt):
+        """Build the image generation arguments for generate_art."""
+        return {
+            "model": "dall-e-3",
+            "prompt": prompt,
+            "size": "1024x1024",
+            "quality": "standard",
+            "n": 1,
+        }
 
     @retry_request(max_retries=3, delay=2, backoff=2)
     def generate_metadata(self, hymn_name, style="Deep House"):
@@ -38,23 +66,8 @@ class ContentGenerator:
                 "tags": list
             }
         """
-        prompt = (
-            f"Generate metadata for a YouTube video featuring a {style} remake of the hymn '{hymn_name}'.\n"
-            f"Provide the following fields in JSON format:\n"
-            f"1. title: A catchy, modern title for the video.\n"
-            f"2. description: A compelling description (max 1000 chars) explaining the remake.\n"
-            f"3. tags: A list of 10 relevant tags."
-        )
-
-        logger.info(f"Generating metadata for '{hymn_name}'...")
-        response = self.client.chat.completions.create(
-            model="gpt-4-turbo",  # Using a model that supports JSON mode
-            messages=[
-                {"role": "system", "content": "You are a creative content strategist for a music channel. You must respond in valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={ "type": "json_object" }
-        )
+        logger.info("Generating metadata for '%s'...", hymn_name)
+        response = self.client.chat.completions.create(**self._metadata_request(hymn_name, style))
 
         content = response.choices[0].message.content
         metadata = json.loads(content)
@@ -72,20 +85,35 @@ class ContentGenerator:
         Returns:
             str: URL of the generated image.
         """
-        logger.info(f"Generating album art for prompt: '{prompt}'...")
-        response = self.client.images.generate(
-            model="dall-e-3",
-            prompt=prompt,
-            size="1024x1024",
-            quality="standard",
-            n=1,
-        )
+        logger.info("Generating album art for prompt: '%s'...", prompt)
+        response = self.client.images.generate(**self._art_request(prompt))
+
+        image_url = response.data[0].url
+        logger.info("Album art generated: %s", image_url)
+        return image_url
+
+    @async_retry_request(max_retries=3, delay=2, backoff=2)
+    async def agenerate_metadata(self, hymn_name, style="Deep House"):
+        """Async variant of generate_metadata using AsyncOpenAI."""
+        logger.info("Generating metadata for '%s'...", hymn_name)
+        response = await self.async_client.chat.completions.create(**self._metadata_request(hymn_name, style))
+
+        metadata = json.loads(response.choices[0].message.content)
+        logger.info("Metadata generated successfully.")
+        return metadata
+
+    @async_retry_request(max_retries=3, delay=2, backoff=2)
+    async def agenerate_art(self, prompt):
+        """Async variant of generate_art using AsyncOpenAI."""
+        logger.info("Generating album art for prompt: '%s'...", prompt)
+        response = await self.async_client.images.generate(**self._art_request(prompt))
 
         image_url = response.data[0].url
-        logger.info(f"Album art generated: {image_url}")
+        logger.info("Album art generated: %s", image_url)
         return image_url
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     if os.environ.get("OPENAI_API_KEY"):
         generator = ContentGenerator()
         # Test metadata
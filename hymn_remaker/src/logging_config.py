@@ -0,0 +1,181 @@
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+import contextvars
+from contextlib import contextmanager
+
+# Fields attached to every record emitted while a job is running (hymn, stage, attempt, ...)
+_job_context = contextvars.ContextVar("job_context", default={})
+
+# Attributes every LogRecord has; anything else was passed via `extra=` and is emitted in JSON output
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "context", "context_prefix"}
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(context_prefix)s%(message)s"
+
+# Maximum characters of subprocess output kept in a log record
+MAX_OUTPUT_CHARS = 2000
+
+# The listener started by the last setup_logging() call
+_listener = None
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Attach fields to every log record emitted inside the block, in this thread or task.
+
+    Args:
+        **fields: Context values, e.g. hymn="amazing_grace", stage="render".
+    """
+    token = _job_context.set({**_job_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _job_context.reset(token)
+
+
+def update_log_context(**fields):
+    """Update the current context until the enclosing log_context() block exits."""
+    _job_context.set({**_job_context.get(), **fields})
+
+
+def get_log_context():
+    """Return a copy of the current context fields."""
+    return dict(_job_context.get())
+
+
+def truncate_output(output, limit=MAX_OUTPUT_CHARS):
+    """
+    Decode and shorten subprocess output for logging, keeping the tail where errors usually are.
+
+    Args:
+        output (bytes or str): Captured stdout/stderr.
+        limit (int): Maximum characters to keep.
+
+    Returns:
+        str: The (possibly truncated) text.
+    """
+    if output is None:
+        return ""
+    if isinstance(output, bytes):
+        output = output.decode(errors="replace")
+    output = output.strip()
+    if len(output) <= limit:
+        return output
+    return f"[... {len(output) - limit} chars truncated ...]\n{output[-limit:]}"
+
+
+class ContextFilter(logging.Filter):
+    """Copy the current job context onto the record while still in the emitting thread."""
+
+    def filter(self, record):
+        record.context = get_log_context()
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable formatter that prefixes the job context as [key=value ...]."""
+
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        context = getattr(record, "context", None) or {}
+        record.context_prefix = "[" + " ".join(f"{k}={v}" for k, v in context.items()) + "] " if context else ""
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with timestamp, level, logger, message, context and extras."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "context", None) or {})
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener.
+
+    The stock prepare() runs the output formatter in the emitting thread and drops exc_info,
+    so the listener's formatter could never render the traceback. Here only the message
+    is resolved (its arguments may change after the call returns); timestamps, JSON and
+    tracebacks are formatted by the listener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+
+class SafeQueueListener(logging.handlers.QueueListener):
+    """QueueListener whose stop() may be called more than once (e.g. manually and at exit)."""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def setup_logging(level=logging.INFO, json_output=False, stream=None):
+    """
+    Configure root logging with a non-blocking queue handler.
+
+    Records are enqueued by the emitting thread and formatted/written by a background
+    listener, so log I/O never blocks pipeline work. Calling it again replaces the previous
+    configuration, flushing and stopping its listener.
+
+    Args:
+        level (int or str): Root log level.
+        json_output (bool): Emit JSON lines instead of text.
+        stream (file): Output stream. Defaults to stderr.
+
+    Returns:
+        SafeQueueListener: The started listener (stopped automatically at exit).
+    """
+    global _listener
+    _stop_listener()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if json_output else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = SafeQueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    # register() would add a hook per call; unregister first so there is only ever one
+    atexit.unregister(_stop_listener)
+    atexit.register(_stop_listener)
+    return _listener
@@ -0,0 +1,104 @@
+import os
+import re
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from .utils import DOWNLOAD_CHUNK_BYTES
+from .planner import DEFAULT_BASE_WAV_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Fixed per-job allowance for API client responses, pipe buffers and interpreter overhead
+JOB_OVERHEAD_BYTES = 16 * 1024 * 1024
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(value):
+    """
+    Parse a human-readable byte size such as "512M" or "2G".
+
+    Args:
+        value (str): Size with an optional K/M/G suffix (binary units).
+
+    Returns:
+        int: Size in bytes.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*", str(value), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def estimate_job_bytes(audio_processor, backends=(), base_wav_path=None, duration=30, sample_rate=48000, channels=2):
+    """
+    Estimate the peak in-process buffers held by one hymn job.
+
+    Transfers and the final encode are streamed, so that part is bounded by chunk sizes.
+    Backends that hold whole files in memory (local MusicGen with a melody checkpoint)
+    add a part proportional to the rendered input; since routing happens later, the
+    largest candidate backend is assumed. Child processes (FluidSynth, ffmpeg) are not counted.
+
+    Args:
+        audio_processor (AudioProcessor): Processor whose chunk size drives the audio working set.
+        backends (list): RemakeBackend candidates for the job.
+        base_wav_path (str): Rendered input WAV, if it already exists; otherwise a three minute hymn is assumed.
+        duration (int): Seconds of audio to generate.
+        sample_rate (int): Expected sample rate of the remake audio.
+        channels (int): Expected channel count of the remake audio.
+
+    Returns:
+        int: Estimated bytes.
+    """
+    if base_wav_path and os.path.exists(base_wav_path):
+        base_wav_bytes = os.path.getsize(base_wav_path)
+    else:
+        base_wav_bytes = DEFAULT_BASE_WAV_BYTES
+    backend_bytes = max((backend.job_bytes(base_wav_bytes, duration) for backend in backends), default=0)
+    return JOB_OVERHEAD_BYTES + DOWNLOAD_CHUNK_BYTES + audio_processor.buffer_bytes(sample_rate, channels) + backend_bytes
+
+
+def estimate_resident_bytes(backends=()):
+    """Memory held once for the whole run, e.g. local model weights."""
+    return sum(backend.resident_bytes() for backend in backends)
+
+
+class AsyncMemoryBudget:
+    def __init__(self, max_bytes=None):
+        """
+        Initialize an in-flight byte budget shared by concurrent jobs on one event loop.
+        Waiting jobs yield to the loop instead of blocking a thread.
+
+        Args:
+            max_bytes (int): Maximum bytes reserved at once. None means unlimited.
+        """
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    def _fits(self, nbytes):
+        # A job larger than the whole budget is still admitted when nothing else is running
+        return self.max_bytes is None or self.in_flight == 0 or self.in_flight + nbytes <= self.max_bytes
+
+    async def acquire(self, nbytes):
+        """Wait until nbytes fit in the budget, then reserve them."""
+        async with self._condition:
+            if not self._fits(nbytes):
+                logger.info("Memory budget full (%d/%d bytes), waiting to admit job...", self.in_flight, self.max_bytes)
+            await self._condition.wait_for(lambda: self._fits(nbytes))
+            self.in_flight += nbytes
+
+    async def release(self, nbytes):
+        """Return nbytes to the budget and wake waiting jobs."""
+        async with self._condition:
+            self.in_flight -= nbytes
+            self._condition.notify_all()
+
+    @asynccontextmanager
+    async def reserve(self, nbytes):
+        """Async context manager that holds nbytes of the budget for the duration of the block."""
+        await self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            await self.release(nbytes)
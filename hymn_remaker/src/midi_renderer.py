@@ -1,8 +1,10 @@
 import os
+import subprocess
 from midi2audio import FluidSynth
 import logging
+from .utils import run_process
+from .logging_config import truncate_output
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class MidiRenderer:
@@ -30,7 +32,7 @@ class MidiRenderer:
             else:
                 raise FileNotFoundError("No default soundfont found. Please provide a path to a valid .sf2 file.")
 
-        logger.info(f"Using SoundFont: {self.soundfont_path}")
+        logger.info("Using SoundFont: %s", self.soundfont_path)
         self.fs = FluidSynth(self.soundfont_path)
 
     def render(self, midi_path, output_path):
@@ -44,7 +46,7 @@ class MidiRenderer:
         if not os.path.exists(midi_path):
             raise FileNotFoundError(f"MIDI file not found: {midi_path}")
 
-        logger.info(f"Rendering {midi_path} to {output_path}...")
+        logger.info("Rendering %s to %s...", midi_path, output_path)
 
         try:
             # midi2audio mainly supports play_midi (to speakers) or midi_to_audio (to file)
@@ -57,10 +59,28 @@ class MidiRenderer:
             logger.info("Rendering complete.")
 
         except Exception as e:
-            logger.error(f"Failed to render MIDI: {e}")
+            logger.error("Failed to render MIDI: %s", e)
             raise
 
+    async def arender(self, midi_path, output_path):
+        """
+        Async variant of render. FluidSynth runs as an asyncio subprocess (the same command
+        midi2audio uses), so it is killed if the stage is cancelled or times out.
+        """
+        if not os.path.exists(midi_path):
+            raise FileNotFoundError(f"MIDI file not found: {midi_path}")
+
+        logger.info("Rendering %s to %s...", midi_path, output_path)
+        cmd = ["fluidsynth", "-ni", self.fs.sound_font, midi_path, "-F", output_path, "-r", str(self.fs.sample_rate)]
+        try:
+            await run_process(cmd)
+        except subprocess.CalledProcessError as e:
+            logger.error("Failed to render MIDI: %s", truncate_output(e.stderr))
+            raise
+        logger.info("Rendering complete.")
+
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     # Test execution
     import sys
     if len(sys.argv) > 2:
@@ -0,0 +1,318 @@
+import os
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Per-hymn stage graph in execution order: stage -> stages it depends on
+STAGE_GRAPH = {
+    "render": [],
+    "remake": ["render"],
+    "normalize": ["remake"],
+    "metadata": [],
+    "art": ["metadata"],
+    "video": ["normalize", "art"],
+    "upload": ["video", "metadata"],
+}
+
+# Stages run once per batch when --compilation is set, after every hymn's normalize and metadata
+COMPILATION_GRAPH = {
+    "art": [],
+    "compilation": ["art"],
+    "upload": ["compilation"],
+}
+
+# Rough per-stage costs used when no artifact exists to measure.
+# service: external API billed for the stage (None for local work)
+# seconds: wall time (for "remake" this is Replicate GPU time)
+ESTIMATES = {
+    "render": {"service": None, "seconds": 5},
+    "remake": {"service": "replicate", "seconds": 60},
+    "normalize": {"service": None, "seconds": 2},
+    "metadata": {"service": "openai", "seconds": 5},
+    "art": {"service": "openai", "seconds": 15},
+    "video": {"service": None, "seconds": 10},
+    "upload": {"service": "youtube", "seconds": 30},
+    # Per track: the compilation's single ffmpeg pass encodes every track
+    "compilation": {"service": None, "seconds": 5},
+}
+
+# FluidSynth renders 44.1kHz 16-bit stereo; assume a three minute hymn
+DEFAULT_BASE_WAV_BYTES = 44100 * 2 * 2 * 180
+# MusicGen returns 32kHz 16-bit stereo WAV
+REMAKE_WAV_BYTES_PER_SECOND = 32000 * 2 * 2
+# DALL-E 3 1024x1024 PNG
+ART_BYTES = 1_500_000
+# Still-image H.264 plus 192k audio
+VIDEO_BYTES_PER_SECOND = 400_000
+# YouTube Data API cost of videos.insert
+YOUTUBE_INSERT_UNITS = 1600
+
+
+class PipelinePlanner:
+    def __init__(self, output_dir, skip_render=False, skip_remake=False, upload=False, duration=30,
+                 track_videos=True, remaker=None, compilation=False):
+        """
+        Initialize the PipelinePlanner, which predicts the work main.py would do without doing it.
+
+        Args:
+            output_dir (str): Directory holding existing and future outputs.
+            skip_render (bool): Mirrors --skip-render.
+            skip_remake (bool): Mirrors --skip-remake.
+            upload (bool): Mirrors --upload.
+            duration (int): Remake duration in seconds passed to MusicRemaker.remake.
+            track_videos (bool): False mirrors --skip-track-videos.
+            remaker (MusicRemaker): Configured remaker; the remake stage is costed on the backend
+                                    its policy would try first. Without one, Replicate is assumed.
+            compilation (bool): Mirrors --compilation.
+        """
+        self.output_dir = output_dir
+        self.skip_render = skip_render
+        self.skip_remake = skip_remake
+        self.upload = upload
+        self.duration = duration
+        self.track_videos = track_videos
+        self.remaker = remaker
+        self.compilation = compilation
+
+    def _scan_outputs(self):
+        """Return {filename: size} for the output directory using a single directory listing."""
+        existing = {}
+        if not os.path.isdir(self.output_dir):
+            return existing
+        with os.scandir(self.output_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    existing[entry.name] = entry.stat().st_size
+        return existing
+
+    def plan_hymn(self, midi_path, existing):
+        """
+        Build the stage plan for a single hymn.
+
+        Args:
+            midi_path (str): Path to the input MIDI file.
+            existing (dict): {filename: size} of files already in the output directory.
+
+        Returns:
+            dict: {
+                "name": str,
+                "stages": [{"stage", "depends_on", "action", "service", "calls", "seconds",
+                            "upload_bytes", "download_bytes", "cost"}, ...]
+            }
+            The remake stage also has "backend" and "gpu_seconds". Its action is "fail"
+            when the routing policy leaves no backend (e.g. everything is above the cost cap),
+            and every stage depending on it fails with it. Stages depending on a stage that
+            won't produce its output (e.g. upload under --skip-track-videos) are skipped.
+        """
+        name = os.path.splitext(os.path.basename(midi_path))[0]
+        base_file = f"{name}_base.wav"
+        remake_file = f"{name}_remake.wav"
+
+        # Skipped stages whose output is already on disk: their dependents still run
+        reused = set()
+        if self.skip_render and base_file in existing:
+            reused.add("render")
+        if self.skip_remake and remake_file in existing:
+            reused.add("remake")
+        skipped = set()
+        if not self.upload:
+            skipped.add("upload")
+        if not self.track_videos:
+            skipped.update(("art", "video"))
+
+        remake_bytes = existing.get(remake_file, REMAKE_WAV_BYTES_PER_SECOND * self.duration)
+        transfer = {
+            "remake": (existing.get(base_file, DEFAULT_BASE_WAV_BYTES), remake_bytes),
+            "video": (0, ART_BYTES),
+            "upload": (existing.get(f"{name}.mp4", VIDEO_BYTES_PER_SECOND * self.duration), 0),
+        }
+
+        stages = []
+        actions = {}
+        # Stages whose output won't exist: a stage depending on one fails or is skipped with it
+        missing = set()
+        for stage, depends_on in STAGE_GRAPH.items():
+            estimate = ESTIMATES[stage]
+            if stage in reused or stage in skipped:
+                action = "skip"
+            elif any(actions[dep] == "fail" for dep in depends_on):
+                action = "fail"
+            elif any(dep in missing for dep in depends_on):
+                action = "skip"
+            else:
+                action = "run"
+            runs = action == "run"
+            upload_bytes, download_bytes = transfer.get(stage, (0, 0))
+            entry = {
+                "stage": stage,
+                "depends_on": depends_on,
+                "action": action,
+                "service": estimate["service"],
+                "calls": 1 if runs and estimate["service"] else 0,
+                "seconds": estimate["seconds"] if runs else 0,
+                "upload_bytes": upload_bytes if runs else 0,
+                "download_bytes": download_bytes if runs else 0,
+                "cost": 0.0,
+            }
+            if stage == "remake":
+                self._plan_remake(entry, runs)
+            actions[stage] = entry["action"]
+            if entry["action"] == "fail" or (entry["action"] == "skip" and stage not in reused):
+                missing.add(stage)
+            stages.append(entry)
+
+        return {"name": name, "stages": stages}
+
+    def _plan_remake(self, entry, runs):
+        """Cost the remake stage on the backend the routing policy would try first."""
+        entry["backend"] = "replicate"
+        entry["gpu_seconds"] = entry["seconds"]
+        if self.remaker is None:
+            return
+
+        candidates = self.remaker.route(self.duration)
+        if not candidates:
+            entry.update(backend=None, service=None, calls=0, seconds=0, gpu_seconds=0, upload_bytes=0,
+                         download_bytes=0, action="fail" if runs else "skip")
+            return
+
+        backend = candidates[0]
+        entry["backend"] = backend.name
+        entry["service"] = backend.service
+        if not runs:
+            entry["gpu_seconds"] = 0
+            return
+        entry["calls"] = 1 if backend.service else 0
+        entry["seconds"] = round(backend.estimate_latency(self.duration))
+        entry["cost"] = backend.estimate_cost(self.duration)
+        if backend.service:
+            entry["gpu_seconds"] = round(backend.per_second * self.duration)
+        else:
+            # Local generation: no GPU rental and nothing crosses the network
+            entry.update(gpu_seconds=0, upload_bytes=0, download_bytes=0)
+
+    def plan_compilation(self, track_count):
+        """
+        Build the stage plan for the compilation video joining `track_count` hymns.
+
+        Returns:
+            dict: {"name": "compilation", "stages": [...]} with the same stage keys as plan_hymn.
+        """
+        runs = track_count > 0
+        video_bytes = VIDEO_BYTES_PER_SECOND * self.duration * track_count
+        plan = {
+            "art": (ESTIMATES["art"]["service"], ESTIMATES["art"]["seconds"], 0, ART_BYTES),
+            "compilation": (None, ESTIMATES["compilation"]["seconds"] * track_count, 0, 0),
+            "upload": (ESTIMATES["upload"]["service"], ESTIMATES["upload"]["seconds"], video_bytes, 0),
+        }
+
+        stages = []
+        for stage, depends_on in COMPILATION_GRAPH.items():
+            service, seconds, upload_bytes, download_bytes = plan[stage]
+            stage_runs = runs and (stage != "upload" or self.upload)
+            stages.append({
+                "stage": stage,
+                "depends_on": depends_on,
+                "action": "run" if stage_runs else "skip",
+                "service": service,
+                "calls": 1 if stage_runs and service else 0,
+                "seconds": seconds if stage_runs else 0,
+                "upload_bytes": upload_bytes if stage_runs else 0,
+                "download_bytes": download_bytes if stage_runs else 0,
+                "cost": 0.0,
+            })
+        return {"name": "compilation", "stages": stages}
+
+    def plan(self, midi_files):
+        """
+        Build the plan for a batch of MIDI files.
+
+        Args:
+            midi_files (list): Paths to the input MIDI files.
+
+        Returns:
+            dict: {"hymns": [...], "compilation": {...} or None, "totals": {...}}
+        """
+        existing = self._scan_outputs()
+        hymns = [self.plan_hymn(path, existing) for path in midi_files]
+        if self.compilation:
+            # Only hymns that reach normalize end up in the compilation
+            track_count = sum(
+                1 for hymn in hymns
+                if next(s for s in hymn["stages"] if s["stage"] == "normalize")["action"] != "fail"
+            )
+            compilation = self.plan_compilation(track_count)
+        else:
+            compilation = None
+
+        totals = {
+            "hymns": len(hymns),
+            "run": 0,
+            "skip": 0,
+            "fail": 0,
+            "calls": {},
+            "seconds": 0,
+            "gpu_seconds": 0,
+            "upload_bytes": 0,
+            "download_bytes": 0,
+            "youtube_quota_units": 0,
+            "cost": 0.0,
+        }
+        for hymn in hymns + ([compilation] if compilation else []):
+            for stage in hymn["stages"]:
+                totals[stage["action"]] += 1
+                if stage["calls"]:
+                    service = stage["service"]
+                    totals["calls"][service] = totals["calls"].get(service, 0) + stage["calls"]
+                totals["seconds"] += stage["seconds"]
+                totals["upload_bytes"] += stage["upload_bytes"]
+                totals["download_bytes"] += stage["download_bytes"]
+                totals["cost"] += stage["cost"]
+                if stage["stage"] == "remake":
+                    totals["gpu_seconds"] += stage["gpu_seconds"]
+                if stage["stage"] == "upload":
+                    totals["youtube_quota_units"] += stage["calls"] * YOUTUBE_INSERT_UNITS
+
+        return {"hymns": hymns, "compilation": compilation, "totals": totals}
+
+
+def _format_bytes(size):
+    """Format a byte count with a binary unit suffix."""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+
+
+def format_plan(plan):
+    """
+    Render a plan as human-readable text.
+
+    Args:
+        plan (dict): Result of PipelinePlanner.plan().
+
+    Returns:
+        str: One line per hymn (and the compilation) followed by a summary.
+    """
+    lines = []
+    for hymn in plan["hymns"] + ([plan["compilation"]] if plan.get("compilation") else []):
+        actions = " ".join(
+            f"{s['stage']}={s['action']}" + (f"({s['backend']})" if s.get("backend") and s["action"] == "run" else "")
+            for s in hymn["stages"]
+        )
+        lines.append(f"{hymn['name']}: {actions}")
+
+    totals = plan["totals"]
+    calls = ", ".join(f"{service}={count}" for service, count in sorted(totals["calls"].items())) or "none"
+    lines.extend([
+        "",
+        f"Hymns: {totals['hymns']}",
+        f"Stages: {totals['run']} to run, {totals['skip']} skipped"
+        + (f", {totals['fail']} blocked by no remake backend within the cost cap" if totals["fail"] else ""),
+        f"API calls: {calls}",
+        f"YouTube quota: {totals['youtube_quota_units']} units",
+        f"Estimated time (sequential): {totals['seconds']}s, of which Replicate GPU: {totals['gpu_seconds']}s",
+        f"Estimated remake cost: ${totals['cost']:.2f}",
+        f"Upload: {_format_bytes(totals['upload_bytes'])}, Download: {_format_bytes(totals['download_bytes'])}",
+    ])
+    return "\n".join(lines)
@@ -1,31 +1,411 @@
 import os
-import replicate
+import time
+import random
+import asyncio
+import wave
+import tempfile
+import threading
+import httpx
 import logging
-from .utils import retry_request
+import numpy as np
+from .utils import retry_request, async_retry_request
+from .timeouts import CANCEL_TIMEOUT
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+POLICIES = ("failover", "least-latency", "cost-capped")
+
+# Weight of the newest observation in a backend's latency estimate
+LATENCY_SMOOTHING = 0.3
+
+# Seconds added to a failed run's elapsed time: a failure costs the time spent plus a fall-through
+FAILURE_PENALTY = 60.0
+
+# Share of least-latency jobs that try a randomly chosen non-preferred backend first, so a
+# backend whose estimate was inflated by a bad spell gets re-measured and can win back traffic
+EXPLORATION_RATE = 0.1
+
+# Approximate parameter counts of the public MusicGen checkpoints, most specific name first
+MUSICGEN_PARAMS = (("large", 3.3e9), ("medium", 1.5e9), ("melody", 1.5e9), ("small", 300e6))
+# MusicGen generates 32kHz audio
+MUSICGEN_SAMPLE_RATE = 32000
+# Default local checkpoint; only "melody" checkpoints are conditioned on the rendered hymn
+DEFAULT_LOCAL_MODEL = "facebook/musicgen-melody"
+
+
+class RemakeBackend:
+    """
+    Base class for music generation backends used by MusicRemaker.
+
+    Latency is modelled as overhead + per_second * duration. The overhead (queueing, model
+    load, upload) is refined from observed runs; per_second is the generation cost per
+    second of output. cost_per_second is the price of one second of generation time.
+    """
+    name = "base"
+    # Billed external service the job runs on (None for local compute); used by the planner
+    service = None
+
+    def __init__(self, overhead=0.0, per_second=1.0, cost_per_second=0.0):
+        self.overhead = overhead
+        self.per_second = per_second
+        self.cost_per_second = cost_per_second
+        self._lock = threading.Lock()
+
+    def estimate_latency(self, duration):
+        """Estimated wall-clock seconds to produce `duration` seconds of audio."""
+        return self.overhead + self.per_second * duration
+
+    def estimate_cost(self, duration):
+        """Estimated price of producing `duration` seconds of audio."""
+        return self.cost_per_second * self.per_second * duration
+
+    def record_latency(self, duration, elapsed):
+        """Fold an observed run into the overhead estimate."""
+        observed_overhead = max(0.0, elapsed - self.per_second * duration)
+        with self._lock:
+            self.overhead += LATENCY_SMOOTHING * (observed_overhead - self.overhead)
+
+    def record_failure(self, duration, elapsed):
+        """Fold a failed run into the estimate as the time it wasted plus FAILURE_PENALTY."""
+        self.record_latency(duration, elapsed + FAILURE_PENALTY)
+
+    def record_unfinished(self, duration, elapsed):
+        """
+        Fold a run that was cancelled (e.g. by the stage deadline) before finishing.
+
+        The elapsed time is only a lower bound, so it can raise the estimate but never lower it.
+        """
+        if elapsed > self.estimate_latency(duration):
+            self.record_latency(duration, elapsed)
+
+    def job_bytes(self, base_wav_bytes, duration):
+        """
+        Peak in-process memory one job holds on this backend, beyond the streamed buffers.
+
+        Args:
+            base_wav_bytes (int): Size of the rendered input WAV.
+            duration (int): Seconds of audio to generate.
+        """
+        return 0
+
+    def resident_bytes(self):
+        """Memory held for the whole run however many jobs are in flight (e.g. model weights)."""
+        return 0
+
+    def remake(self, audio_path, prompt, duration):
+        """
+        Generate a remake.
+
+        Returns:
+            str: URL of the generated audio, or path to a local WAV file.
+        """
+        raise NotImplementedError
+
+    async def aremake(self, audio_path, prompt, duration):
+        """Async variant of remake. Defaults to running remake in a worker thread."""
+        return await asyncio.to_thread(self.remake, audio_path, prompt, duration)
+
+
+class ReplicateBackend(RemakeBackend):
+    name = "replicate"
+    service = "replicate"
+
+    # Using meta/musicgen-melody which is good for conditioning on input melody
+    # The model hash might change, so checking replicate's latest
+    # This is musicgen-melody
+    model = "meta/musicgen:671ac904629c9798ddc38d7747750e2f54e63d179aa2e84786d1a2d6cc7809a6"
+
+    def __init__(self, overhead=30.0, per_second=1.0, cost_per_second=0.0014):
+        super().__init__(overhead=overhead, per_second=per_second, cost_per_second=cost_per_second)
+
+    def _input(self, audio_file, prompt, duration):
+        return {
+            "prompt": prompt,
+            "input_audio": audio_file,
+            "duration": duration,
+            "model_version": "melody", # Specific for melody conditioning
+            "normalization_strategy": "peak"
+        }
+
+    @retry_request(max_retries=3, delay=2, backoff=2)
+    def remake(self, audio_path, prompt, duration):
+        import replicate
+
+        # Replicate expects a file object for input; the "url" strategy streams it to the
+        # files API instead of base64-encoding the whole WAV in memory
+        with open(audio_path, "rb") as audio_file:
+            output = replicate.run(
+                self.model,
+                input=self._input(audio_file, prompt, duration),
+                file_encoding_strategy="url",
+                use_file_output=False
+            )
+        return output
+
+    async def aremake(self, audio_path, prompt, duration):
+        # The prediction is created explicitly (rather than via async_run) so a cancelled,
+        # timed-out or failed job can cancel it instead of leaving it billing GPU time.
+        # Only creation is retried; a polling error keeps polling the same prediction, so a
+        # flaky connection never leaves a second prediction running alongside the first.
+        prediction = await self._create_prediction(audio_path, prompt, duration)
+
+        try:
+            await self._wait_for_prediction(prediction)
+        except BaseException:
+            logger.warning("Cancelling Replicate prediction %s", prediction.id)
+            try:
+                await asyncio.wait_for(prediction.async_cancel(), CANCEL_TIMEOUT)
+            except Exception as e:
+                logger.warning("Could not cancel Replicate prediction %s: %s", prediction.id, e)
+            raise
+
+        if prediction.status != "succeeded":
+            raise RuntimeError(f"Replicate prediction {prediction.id} {prediction.status}: {prediction.error}")
+        return prediction.output
+
+    @async_retry_request(max_retries=3, delay=2, backoff=2)
+    async def _create_prediction(self, audio_path, prompt, duration):
+        import replicate
+
+        with open(audio_path, "rb") as audio_file:
+            return await replicate.predictions.async_create(
+                version=self.model.split(":", 1)[1],
+                input=self._input(audio_file, prompt, duration),
+                file_encoding_strategy="url"
+            )
+
+    @async_retry_request(max_retries=3, delay=2, backoff=2, exceptions=(httpx.TransportError,))
+    async def _wait_for_prediction(self, prediction):
+        """Poll until the prediction finishes; a transport error resumes polling the same prediction."""
+        await prediction.async_wait()
+
+
+class LocalMusicGenBackend(RemakeBackend):
+    name = "local"
+
+    def __init__(self, model_name=DEFAULT_LOCAL_MODEL, device="cpu", overhead=20.0, per_second=3.0,
+                 max_concurrent=1):
+        """
+        Run MusicGen locally through Hugging Face transformers.
+
+        "melody" checkpoints (e.g. facebook/musicgen-melody) are conditioned on the input
+        audio; other checkpoints such as musicgen-small generate from the text prompt only.
+
+        Args:
+            model_name (str): Hugging Face model id.
+            device (str): Torch device, e.g. "cpu" or "cuda".
+            overhead (float): Initial estimate of fixed seconds per job.
+            per_second (float): Seconds of compute per second of generated audio.
+            max_concurrent (int): Generations allowed to share the model at once. Further jobs
+                                  wait their turn instead of competing for the same CPU/GPU.
+        """
+        super().__init__(overhead=overhead, per_second=per_second, cost_per_second=0.0)
+        self.model_name = model_name
+        self.device = device
+        self.melody = "melody" in model_name
+        self.max_concurrent = max_concurrent
+        self._model = None
+        self._processor = None
+        self._load_lock = threading.Lock()
+        self._slots = threading.Semaphore(max_concurrent)
+        self._async_slots = None
+        self._async_slots_loop = None
+
+    def _load(self):
+        """Import torch/transformers and load the model on first use."""
+        with self._load_lock:
+            if self._model is not None:
+                return
+            try:
+                import torch  # noqa: F401
+                from transformers import AutoProcessor, MusicgenForConditionalGeneration, MusicgenMelodyForConditionalGeneration
+            except ImportError as e:
+                raise RuntimeError("The local MusicGen backend requires 'torch' and 'transformers'.") from e
+
+            logger.info("Loading local MusicGen model %s on %s...", self.model_name, self.device)
+            model_class = MusicgenMelodyForConditionalGeneration if self.melody else MusicgenForConditionalGeneration
+            self._processor = AutoProcessor.from_pretrained(self.model_name)
+            self._model = model_class.from_pretrained(self.model_name).to(self.device)
+
+    def resident_bytes(self):
+        """float32 weights of the checkpoint, estimated from its size in the model name."""
+        params = next((count for key, count in MUSICGEN_PARAMS if key in self.model_name), MUSICGEN_PARAMS[0][1])
+        return int(params * 4)
+
+    def job_bytes(self, base_wav_bytes, duration):
+        # Generated float32 samples plus the clipped and int16 copies written to the WAV
+        output = int(duration * MUSICGEN_SAMPLE_RATE * (4 + 4 + 2))
+        if not self.melody:
+            return output
+        # _load_melody holds the whole input: float32 chunks, their concatenation, the mono mix
+        # and a float64 resample, roughly 8x the 16-bit stereo WAV
+        return output + 8 * base_wav_bytes
+
+    def _load_melody(self, audio_path, sampling_rate):
+        """Read the input WAV as mono float32 at the model's sampling rate."""
+        from scipy.signal import resample_poly
+        from .audio_processor import read_wav_chunks
+
+        with wave.open(audio_path, "rb") as wav:
+            source_rate = wav.getframerate()
+        audio = np.concatenate(list(read_wav_chunks(audio_path, source_rate))).mean(axis=1)
+        if source_rate != sampling_rate:
+            audio = resample_poly(audio, sampling_rate, source_rate)
+        return audio.astype(np.float32)
+
+    def remake(self, audio_path, prompt, duration, cancel=None):
+        """
+        Generate locally.
+
+        Args:
+            cancel (threading.Event): Once set, generation stops at the next token so a
+                                      cancelled or timed-out job releases the CPU/GPU.
+        """
+        with self._slots:
+            if cancel is not None and cancel.is_set():
+                raise InterruptedError("Local MusicGen generation cancelled")
+            return self._generate(audio_path, prompt, duration, cancel)
+
+    def _generate(self, audio_path, prompt, duration, cancel):
+        """Run one generation; the caller holds a slot."""
+        self._load()
+
+        sampling_rate = self._model.config.audio_encoder.sampling_rate
+        if self.melody:
+            inputs = self._processor(
+                audio=self._load_melody(audio_path, sampling_rate),
+                sampling_rate=sampling_rate,
+                text=[prompt],
+                padding=True,
+                return_tensors="pt"
+            )
+        else:
+            logger.warning("%s is not a melody checkpoint; generating %s from the text prompt only, "
+                           "without melody conditioning.", self.model_name, audio_path)
+            inputs = self._processor(text=[prompt], padding=True, return_tensors="pt")
+
+        max_new_tokens = int(duration * self._model.config.audio_encoder.frame_rate)
+        audio_values = self._model.generate(
+            **inputs.to(self.device),
+            max_new_tokens=max_new_tokens,
+            stopping_criteria=self._stopping_criteria(cancel)
+        )
+        if cancel is not None and cancel.is_set():
+            raise InterruptedError("Local MusicGen generation cancelled")
+
+        samples = np.clip(audio_values[0, 0].cpu().numpy(), -1.0, 1.0)
+        fd, output_path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        with wave.open(output_path, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sampling_rate)
+            wav.writeframes((samples * 32767).astype("<i2").tobytes())
+        return output_path
+
+    async def aremake(self, audio_path, prompt, duration):
+        """Generate in a worker thread; cancelling the awaiting task stops generation at the next token."""
+        # Queued jobs wait on the event loop rather than parking a worker thread each
+        async with self._loop_slots():
+            cancel = threading.Event()
+            try:
+                return await asyncio.to_thread(self.remake, audio_path, prompt, duration, cancel)
+            except asyncio.CancelledError:
+                cancel.set()
+                raise
+
+    def _loop_slots(self):
+        """The asyncio semaphore bounding generations on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._async_slots_loop is not loop:
+            self._async_slots = asyncio.Semaphore(self.max_concurrent)
+            self._async_slots_loop = loop
+        return self._async_slots
+
+    @staticmethod
+    def _stopping_criteria(cancel):
+        """Wrap a cancel event as a transformers StoppingCriteriaList (None without an event)."""
+        if cancel is None:
+            return None
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList
+
+        class Cancelled(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return torch.full((input_ids.shape[0],), cancel.is_set(), dtype=torch.bool, device=input_ids.device)
+
+        return StoppingCriteriaList([Cancelled()])
+
+
+BACKENDS = {
+    "replicate": ReplicateBackend,
+    "local": LocalMusicGenBackend,
+}
+
+
 class MusicRemaker:
-    def __init__(self, api_token=None):
+    def __init__(self, api_token=None, backends=None, policy="failover", max_cost=None,
+                 exploration_rate=EXPLORATION_RATE, backend_options=None):
         """
-        Initialize the MusicRemaker with a Replicate API token.
+        Initialize the MusicRemaker with one or more generation backends.
 
         Args:
             api_token (str): Replicate API token. Defaults to REPLICATE_API_TOKEN env var.
+            backends (list): Backend names from BACKENDS or RemakeBackend instances, in
+                             preference order. Defaults to ["replicate"].
+            policy (str): Routing policy, one of POLICIES:
+                          "failover" tries backends in the given order,
+                          "least-latency" tries the lowest estimated latency first,
+                          "cost-capped" drops backends above max_cost and tries the cheapest first.
+            max_cost (float): Per-job cost cap in USD for the "cost-capped" policy.
+            exploration_rate (float): Share of "least-latency" jobs that try a random
+                                      non-preferred backend first to refresh its estimate.
+            backend_options (dict): Constructor keyword arguments per backend name, e.g.
+                                    {"local": {"model_name": "facebook/musicgen-melody"}}.
         """
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown routing policy: {policy}. Choose from {', '.join(POLICIES)}.")
+
+        backends = backends or ["replicate"]
+        unknown = [b for b in backends if isinstance(b, str) and b not in BACKENDS]
+        if unknown:
+            raise ValueError(f"Unknown remake backend: {', '.join(unknown)}. Choose from {', '.join(BACKENDS)}.")
+
+        backend_options = backend_options or {}
+        self.backends = [BACKENDS[b](**backend_options.get(b, {})) if isinstance(b, str) else b for b in backends]
+        self.policy = policy
+        self.max_cost = max_cost
+        self.exploration_rate = exploration_rate
+        self._random = random.Random()
+
         self.api_token = api_token or os.environ.get("REPLICATE_API_TOKEN")
-        if not self.api_token:
+        if not self.api_token and any(b.name == "replicate" for b in self.backends):
             logger.warning("REPLICATE_API_TOKEN not set. MusicRemaker will not function.")
 
         # Authenticate (though replicate client usually does this automatically from env)
         if self.api_token:
             os.environ["REPLICATE_API_TOKEN"] = self.api_token
 
-    @retry_request(max_retries=3, delay=2, backoff=2)
+    def route(self, duration):
+        """
+        Order the backends to try for a job according to the routing policy.
+
+        Args:
+            duration (int): Requested output duration in seconds.
+
+        Returns:
+            list: RemakeBackend instances, most preferred first.
+        """
+        if self.policy == "least-latency":
+            return sorted(self.backends, key=lambda b: b.estimate_latency(duration))
+        if self.policy == "cost-capped":
+            affordable = [b for b in self.backends if self.max_cost is None or b.estimate_cost(duration) <= self.max_cost]
+            return sorted(affordable, key=lambda b: b.estimate_cost(duration))
+        return list(self.backends)
+
     def remake(self, audio_path, prompt, duration=30):
         """
-        Generate a remake of the input audio using MusicGen via Replicate.
+        Generate a remake of the input audio using the routed MusicGen backends.
 
         Args:
             audio_path (str): Path to the input audio file (WAV/MP3).
@@ -33,35 +413,72 @@ class MusicRemaker:
             duration (int): Duration of the output in seconds.
 
         Returns:
-            str: URL of the generated audio.
+            str: URL of the generated audio (remote backends) or path to a local WAV file.
         """
-        if not os.path.exists(audio_path):
-            raise FileNotFoundError(f"Input audio file not found: {audio_path}")
+        candidates = self._candidates(audio_path, duration)
 
-        logger.info(f"Remaking {audio_path} with prompt: '{prompt}'...")
+        last_error = None
+        for backend in candidates:
+            logger.info("Remaking %s with prompt: '%s' via %s...", audio_path, prompt, backend.name)
+            start = time.monotonic()
+            try:
+                output = backend.remake(audio_path, prompt, duration)
+            except Exception as e:
+                logger.warning("Remake backend %s failed: %s", backend.name, e)
+                backend.record_failure(duration, time.monotonic() - start)
+                last_error = e
+                continue
+            backend.record_latency(duration, time.monotonic() - start)
+            logger.info("Generation complete. Output: %s", output)
+            return output
 
-        # Using meta/musicgen-melody which is good for conditioning on input melody
-        # The model hash might change, so checking replicate's latest
-        # This is musicgen-melody
-        model = "meta/musicgen:671ac904629c9798ddc38d7747750e2f54e63d179aa2e84786d1a2d6cc7809a6"
+        raise last_error
 
-        # Replicate expects a file object for input
-        with open(audio_path, "rb") as audio_file:
-            output = replicate.run(
-                model,
-                input={
-                    "prompt": prompt,
-                    "input_audio": audio_file,
-                    "duration": duration,
-                    "model_version": "melody", # Specific for melody conditioning
-                    "normalization_strategy": "peak"
-                }
-            )
+    async def aremake(self, audio_path, prompt, duration=30):
+        """Async variant of remake; remote backends await the network, local ones run in a thread."""
+        candidates = self._candidates(audio_path, duration)
 
-        logger.info(f"Generation complete. Output: {output}")
-        return output
+        last_error = None
+        for backend in candidates:
+            logger.info("Remaking %s with prompt: '%s' via %s...", audio_path, prompt, backend.name)
+            start = time.monotonic()
+            try:
+                output = await backend.aremake(audio_path, prompt, duration)
+            except asyncio.CancelledError:
+                # A stage deadline hit: the run was at least this slow
+                backend.record_unfinished(duration, time.monotonic() - start)
+                raise
+            except Exception as e:
+                logger.warning("Remake backend %s failed: %s", backend.name, e)
+                backend.record_failure(duration, time.monotonic() - start)
+                last_error = e
+                continue
+            backend.record_latency(duration, time.monotonic() - start)
+            logger.info("Generation complete. Output: %s", output)
+            return output
+
+        raise last_error
+
+    def _candidates(self, audio_path, duration):
+        """Validate the input and return the routed backends, raising if none qualify."""
+        if not os.path.exists(audio_path):
+            raise FileNotFoundError(f"Input audio file not found: {audio_path}")
+
+        candidates = self.route(duration)
+        if not candidates:
+            raise RuntimeError(f"No remake backend fits the cost cap of {self.max_cost}.")
+
+        # Estimates only move for backends that get traffic, so now and then lead with another
+        # one; the rest of the order is kept as the fall-through
+        if self.policy == "least-latency" and len(candidates) > 1 and self._random.random() < self.exploration_rate:
+            probe = self._random.choice(candidates[1:])
+            logger.debug("Probing remake backend %s (estimate %.0fs)", probe.name, probe.estimate_latency(duration))
+            candidates.remove(probe)
+            candidates.insert(0, probe)
+        return candidates
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     if os.environ.get("REPLICATE_API_TOKEN"):
         remaker = MusicRemaker()
         import sys
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Default per-stage deadlines in seconds. A stage that runs longer is cancelled,
+# which kills its child processes, cancels remote predictions and frees the hymn's slot.
+DEFAULT_STAGE_TIMEOUTS = {
+    "render": 300,
+    "remake": 900,
+    "download": 300,
+    "normalize": 300,
+    "metadata": 120,
+    "art": 180,
+    "video": 600,
+    "compilation": 3600,
+    "upload": 3600,
+}
+
+# Socket-level timeout for HTTP clients: the longest wait for a connection or the next bytes
+HTTP_TIMEOUT = 60
+
+# How long cleanup (e.g. cancelling a Replicate prediction) may take once a stage is cancelled
+CANCEL_TIMEOUT = 10
+
+
+class StageTimeout(TimeoutError):
+    def __init__(self, stage, seconds):
+        """
+        Raised when a pipeline stage exceeds its deadline.
+
+        Args:
+            stage (str): Name of the stage that timed out.
+            seconds (float): The deadline that was exceeded.
+        """
+        super().__init__(f"Stage '{stage}' timed out after {seconds:g}s")
+        self.stage = stage
+        self.seconds = seconds
+
+
+def parse_stage_timeouts(specs=None, defaults=DEFAULT_STAGE_TIMEOUTS):
+    """
+    Merge "stage=seconds" overrides into the default stage deadlines.
+
+    Args:
+        specs (list): Strings such as "remake=600". "all=SECONDS" sets every stage;
+                      a value of 0 disables the deadline.
+        defaults (dict): Deadlines to start from.
+
+    Returns:
+        dict: stage -> seconds (None for no deadline).
+    """
+    timeouts = dict(defaults)
+    for spec in specs or []:
+        stage, sep, value = spec.partition("=")
+        stage = stage.strip()
+        if not sep or (stage not in timeouts and stage != "all"):
+            raise ValueError(f"Invalid stage timeout '{spec}'; expected STAGE=SECONDS with STAGE one of: all, {', '.join(timeouts)}")
+        seconds = float(value)
+        seconds = seconds if seconds > 0 else None
+        if stage == "all":
+            timeouts = dict.fromkeys(timeouts, seconds)
+        else:
+            timeouts[stage] = seconds
+    return timeouts
+
+
+async def run_stage(stage, awaitable, timeouts=None):
+    """
+    Await a stage under its deadline.
+
+    On timeout the stage is cancelled and awaited, so its cleanup (killing child
+    processes, cancelling predictions) has finished before StageTimeout is raised.
+
+    Args:
+        stage (str): Stage name, looked up in timeouts.
+        awaitable: The stage coroutine.
+        timeouts (dict): stage -> seconds. Missing or None means no deadline.
+
+    Returns:
+        The stage's result.
+    """
+    seconds = (timeouts or {}).get(stage)
+    if not seconds:
+        return await awaitable
+
+    # A task of our own (rather than wait_for) so a TimeoutError raised inside the
+    # stage, e.g. a socket timeout, is not mistaken for the stage deadline
+    task = asyncio.ensure_future(awaitable)
+    try:
+        done, _ = await asyncio.wait({task}, timeout=seconds)
+    except asyncio.CancelledError:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise
+
+    if task in done:
+        return task.result()
+
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    raise StageTimeout(stage, seconds)
@@ -0,0 +1,480 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from google.auth.exceptions import GoogleAuthError
+from .planner import YOUTUBE_INSERT_UNITS
+from .logging_config import log_context
+from .timeouts import StageTimeout, run_stage
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows: the state is still re-read before every write, just without a lock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Default YouTube Data API quota per project per day
+DEFAULT_DAILY_QUOTA = 10000
+# The quota resets at midnight Pacific Time
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+MAX_ATTEMPTS = 3
+# Seconds before a failed upload is retried, doubled for every further attempt
+RETRY_DELAY = 60
+# 4xx statuses that are worth retrying: request timeout and rate limiting
+TRANSIENT_CLIENT_STATUSES = (408, 429)
+# Error reasons meaning nothing more can be uploaded until the daily reset: the project's
+# quota, or the channel's own upload limit (a 400)
+QUOTA_REASONS = ("quotaExceeded", "dailyLimitExceeded", "uploadLimitExceeded")
+# Error reasons for short-term throttling (403s); worth retrying after a delay
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+# Statuses for a resumable session that no longer exists (they expire after about a week)
+EXPIRED_SESSION_STATUSES = (404, 410)
+
+
+def file_signature(path):
+    """(size, mtime) of a file, or None if it doesn't exist; tells a regenerated video from the uploaded one."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime]
+
+
+def error_reasons(error):
+    """
+    Return the "reason" values of a Google API error response, e.g. ["quotaExceeded"].
+
+    Args:
+        error (Exception): Typically a googleapiclient HttpError, with .resp and .content.
+
+    Returns:
+        list: Reasons from the error body; empty for other exceptions or unparseable bodies.
+    """
+    if getattr(error, "resp", None) is None:
+        return []
+    content = getattr(error, "content", b"") or b""
+    if isinstance(content, bytes):
+        content = content.decode(errors="replace")
+    try:
+        body = json.loads(content)
+        return [item.get("reason") for item in body["error"].get("errors", [])]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return []
+
+
+def is_quota_error(error):
+    """Return True if the YouTube API says no more uploads fit until the daily reset."""
+    return any(reason in QUOTA_REASONS for reason in error_reasons(error))
+
+
+def is_rate_limit_error(error):
+    """Return True if the YouTube API throttled the request; it may succeed after a delay."""
+    return any(reason in RATE_LIMIT_REASONS for reason in error_reasons(error))
+
+
+def is_permanent_error(error):
+    """
+    Return True if retrying an upload can't help: authentication failures and 4xx responses
+    other than timeouts and rate limits (check is_quota_error first; quota errors are 4xx too).
+    """
+    if isinstance(error, (GoogleAuthError, FileNotFoundError)):
+        return True
+    if is_rate_limit_error(error):
+        return False
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status is None:
+        return False
+    status = int(status)
+    return 400 <= status < 500 and status not in TRANSIENT_CLIENT_STATUSES
+
+
+def _process_alive(pid):
+    """True if a process with this pid exists (on this host)."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class UploadQueue:
+    def __init__(self, path, daily_quota=DEFAULT_DAILY_QUOTA, insert_cost=YOUTUBE_INSERT_UNITS, now=None):
+        """
+        Persistent, prioritized upload queue with daily YouTube quota accounting.
+
+        State lives in a JSON file so deferred uploads survive between runs. A job
+        that was mid-upload when its process died is retried on the next load.
+
+        Several runs may share the file (e.g. a pipeline run and a --drain-uploads cron job):
+        every change holds an flock on "<path>.lock" and re-reads the file first, and a job is
+        claimed before it is uploaded so only one run uploads it.
+
+        Args:
+            path (str): Path to the JSON state file.
+            daily_quota (int): Quota units available per Pacific day.
+            insert_cost (int): Units charged per videos.insert call.
+            now (callable): Returns the current aware datetime. Defaults to the wall clock.
+        """
+        self.path = path
+        self.daily_quota = daily_quota
+        self.insert_cost = insert_cost
+        self._now = now or (lambda: datetime.now(QUOTA_TIMEZONE))
+        self.quota = {"day": None, "used": 0}
+        self.jobs = []
+        self._load()
+
+    def _load(self):
+        with self._locked():
+            orphaned = [
+                job for job in self.jobs
+                if job["status"] == "uploading" and not (job.get("owner") and _process_alive(job["owner"]))
+            ]
+            for job in orphaned:
+                job["status"] = "pending"
+            if orphaned:
+                self.save()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the inter-process lock with the in-memory state refreshed from disk."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._read()
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        """Refresh from disk, updating job dicts in place so callers' references stay valid."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            state = json.load(f)
+        self.quota = state.get("quota", self.quota)
+
+        known = {job["id"]: job for job in self.jobs}
+        jobs = []
+        for stored in state.get("jobs", []):
+            job = known.pop(stored["id"], None)
+            if job is None:
+                job = stored
+            else:
+                job.clear()
+                job.update(stored)
+            jobs.append(job)
+        self.jobs = jobs
+
+    def save(self):
+        """Atomically write the queue state to disk. Callers hold _locked()."""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"quota": self.quota, "jobs": self.jobs}, f, indent=4)
+        os.replace(temp_path, self.path)
+
+    def _today(self):
+        return self._now().astimezone(QUOTA_TIMEZONE).date().isoformat()
+
+    def _roll_over(self):
+        """Start a fresh quota window when the Pacific day has changed."""
+        today = self._today()
+        if self.quota["day"] != today:
+            self.quota = {"day": today, "used": 0}
+
+    def remaining(self):
+        """Quota units left today, including what other runs have used."""
+        with self._locked():
+            self._roll_over()
+            return max(0, self.daily_quota - self.quota["used"])
+
+    def can_upload(self):
+        """True if another insert fits in today's quota."""
+        return self.remaining() >= self.insert_cost
+
+    def charge(self):
+        """Record the cost of one insert call against today's quota."""
+        with self._locked():
+            self._roll_over()
+            self.quota["used"] += self.insert_cost
+            self.save()
+
+    def exhaust(self):
+        """Mark today's quota as used up (the API said so, whatever our count was)."""
+        with self._locked():
+            self._roll_over()
+            self.quota["used"] = max(self.quota["used"], self.daily_quota)
+            self.save()
+
+    def next_reset(self):
+        """Aware datetime of the next quota reset (Pacific midnight)."""
+        now = self._now().astimezone(QUOTA_TIMEZONE)
+        tomorrow = (now + timedelta(days=1)).date()
+        return datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=QUOTA_TIMEZONE)
+
+    def enqueue(self, video_path, metadata, priority=0):
+        """
+        Add a video to the queue.
+
+        Re-enqueuing a path that is pending or uploading is a no-op, as is re-enqueuing an
+        uploaded video whose file is unchanged. A regenerated file is queued again.
+
+        Args:
+            video_path (str): Path to the video file.
+            metadata (dict): Upload metadata (title, description, tags).
+            priority (int): Higher priorities upload first; ties go to the oldest job.
+
+        Returns:
+            dict: The queued (or existing) job.
+        """
+        signature = file_signature(video_path)
+        with self._locked():
+            for job in self.jobs:
+                if job["video_path"] != video_path:
+                    continue
+                if job["status"] in ("pending", "uploading"):
+                    if job["status"] == "pending" and priority > job["priority"]:
+                        job["priority"] = priority
+                        self.save()
+                    return job
+                if job["status"] == "done" and signature is not None and job.get("signature") == signature:
+                    return job
+
+            job = {
+                "id": uuid.uuid4().hex,
+                "video_path": video_path,
+                "metadata": metadata,
+                "priority": priority,
+                "status": "pending",
+                "attempts": 0,
+                "signature": signature,
+                "enqueued_at": time.time(),
+                "not_before": 0,
+                "owner": None,
+                "upload_session": None,
+                "video_id": None,
+                "error": None,
+            }
+            self.jobs.append(job)
+            self.save()
+        logger.info("Queued upload of %s (priority %d)", video_path, priority)
+        return job
+
+    def pending(self):
+        """Pending jobs in upload order, including those waiting out a retry delay."""
+        jobs = [job for job in self.jobs if job["status"] == "pending"]
+        return sorted(jobs, key=lambda job: (-job["priority"], job["enqueued_at"]))
+
+    def next_job(self):
+        """Highest-priority pending job whose retry delay has passed, or None."""
+        with self._locked():
+            now = time.time()
+            return next((job for job in self.pending() if job.get("not_before", 0) <= now), None)
+
+    def retry_wait(self):
+        """Seconds until the next delayed retry is due, or None if no pending job is waiting."""
+        delays = [job.get("not_before", 0) - time.time() for job in self.pending()]
+        return max(0.0, min(delays)) if delays else None
+
+    def claim(self, job):
+        """
+        Mark a pending job as uploading by this process.
+
+        Returns:
+            bool: False if another run claimed or finished it first.
+        """
+        with self._locked():
+            if job["status"] != "pending":
+                return False
+            job.update(status="uploading", attempts=job["attempts"] + 1, owner=os.getpid())
+            self.save()
+            return True
+
+    def update(self, job, **fields):
+        """Update a job's fields and persist."""
+        with self._locked():
+            if not any(existing is job for existing in self.jobs):
+                self.jobs.append(job)
+            job.update(fields)
+            self.save()
+
+
+class UploadScheduler:
+    def __init__(self, queue, video_producer, max_attempts=MAX_ATTEMPTS, wait_for_reset=False, timeouts=None,
+                 retry_delay=RETRY_DELAY):
+        """
+        Background task that drains an UploadQueue as fast as the daily quota allows.
+
+        Args:
+            queue (UploadQueue): The persistent queue.
+            video_producer (VideoProducer): Performs the uploads.
+            max_attempts (int): Attempts per job before it is marked failed.
+            wait_for_reset (bool): When quota runs out, sleep until the reset instead of
+                                   leaving the remaining jobs queued for a later run.
+            timeouts (dict): Stage deadlines; the "upload" entry bounds each upload.
+            retry_delay (float): Seconds before the first retry of a failed upload; doubles
+                                 with each attempt.
+        """
+        self.queue = queue
+        self.video_producer = video_producer
+        self.max_attempts = max_attempts
+        self.wait_for_reset = wait_for_reset
+        self.timeouts = timeouts
+        self.retry_delay = retry_delay
+        self._wakeup = asyncio.Event()
+        self._closed = False
+
+    def submit(self, video_path, metadata, priority=0):
+        """Queue a finished video and wake the scheduler."""
+        job = self.queue.enqueue(video_path, metadata, priority)
+        self._wakeup.set()
+        return job
+
+    def close(self):
+        """No more submissions; run() returns once the queue is drained or deferred."""
+        self._closed = True
+        self._wakeup.set()
+
+    async def _wait_for_work(self, timeout=None):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        """
+        Upload queued videos one at a time, overlapping with whatever else runs on the loop.
+
+        Returns:
+            dict: Counts of "uploaded", "failed", "timed_out" and "deferred" jobs.
+        """
+        stats = {"uploaded": 0, "failed": 0, "timed_out": 0, "deferred": 0}
+        while True:
+            job = self.queue.next_job()
+            if job is None:
+                # Nothing due; wake for new submissions or when a delayed retry comes due
+                retry_wait = self.queue.retry_wait()
+                if retry_wait is None and self._closed:
+                    return stats
+                await self._wait_for_work(retry_wait)
+                continue
+
+            if not self.queue.can_upload():
+                reset = self.queue.next_reset()
+                if self.wait_for_reset:
+                    delay = (reset - self.queue._now()).total_seconds()
+                    logger.info("YouTube quota used up; %d uploads waiting for the reset at %s",
+                                len(self.queue.pending()), reset.isoformat())
+                    await asyncio.sleep(max(1.0, delay))
+                    continue
+                if not self._closed:
+                    # Keep accepting submissions so they are persisted with the right priority
+                    await self._wait_for_work()
+                    continue
+                stats["deferred"] = len(self.queue.pending())
+                logger.info("YouTube quota used up; %d uploads deferred until %s",
+                            stats["deferred"], reset.isoformat())
+                return stats
+
+            with log_context(stage="upload", video=os.path.basename(job["video_path"])):
+                await self._upload(job, stats)
+
+    def _retry_later(self, job, error):
+        """Return a job to the queue after an exponentially growing delay."""
+        delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+        self.queue.update(job, status="pending", owner=None, not_before=time.time() + delay, error=str(error))
+
+    async def _upload(self, job, stats):
+        if not os.path.exists(job["video_path"]):
+            # Fail locally rather than spend quota on a call that can't succeed
+            logger.error("Upload of %s failed: file not found", job["video_path"])
+            self.queue.update(job, status="failed", error="file not found")
+            stats["failed"] += 1
+            return
+
+        if not self.queue.claim(job):
+            # Another run sharing the queue file got there first
+            return
+
+        # YouTube charges the insert once the API has seen it, whether or not it then succeeds;
+        # failures before that (authentication, a dropped connection) cost nothing. A session
+        # kept from an earlier attempt was paid for then, and is resumed rather than inserted
+        # again, so a timed-out upload can't produce a second copy of the video.
+        session_uri = job.get("upload_session")
+        charged = bool(session_uri)
+
+        def session_started(uri):
+            nonlocal charged
+            if uri and uri != job.get("upload_session"):
+                self.queue.update(job, upload_session=uri)
+            if not charged:
+                charged = True
+                self.queue.charge()
+
+        try:
+            video_id = await run_stage(
+                "upload",
+                self.video_producer.aupload_to_youtube(
+                    job["video_path"], job["metadata"], on_session=session_started, session_uri=session_uri
+                ),
+                self.timeouts
+            )
+        except StageTimeout as e:
+            # Kept apart from failures: a stalled connection says nothing about the video
+            stats["timed_out"] += 1
+            if job["attempts"] >= self.max_attempts:
+                logger.error("Upload of %s timed out %d times; giving up", job["video_path"], job["attempts"])
+                self.queue.update(job, status="timeout", owner=None, error=str(e))
+            else:
+                self._retry_later(job, e)
+            return
+        except Exception as e:
+            throttled = is_quota_error(e) or is_rate_limit_error(e)
+            if getattr(e, "resp", None) is not None and not throttled:
+                # The API answered, so the request counted against the quota
+                session_started(None)
+            if is_quota_error(e):
+                logger.warning("YouTube reported quota or upload limit exceeded (%s); deferring %s",
+                               ", ".join(error_reasons(e)), job["video_path"])
+                self.queue.exhaust()
+                self.queue.update(job, status="pending", owner=None, attempts=job["attempts"] - 1)
+                return
+            if session_uri and getattr(getattr(e, "resp", None), "status", None) in EXPIRED_SESSION_STATUSES:
+                logger.warning("Upload session for %s expired; starting a new upload", job["video_path"])
+                self.queue.update(job, status="pending", owner=None, upload_session=None,
+                                  attempts=job["attempts"] - 1)
+                return
+            if is_rate_limit_error(e) and job["attempts"] < self.max_attempts:
+                logger.warning("YouTube rate-limited the upload of %s; retrying later", job["video_path"])
+                self._retry_later(job, e)
+                return
+            if is_permanent_error(e) or job["attempts"] >= self.max_attempts:
+                logger.error("Upload of %s failed permanently: %s", job["video_path"], e)
+                self.queue.update(job, status="failed", owner=None, error=str(e))
+                stats["failed"] += 1
+            else:
+                logger.warning("Upload of %s failed (attempt %d/%d): %s",
+                               job["video_path"], job["attempts"], self.max_attempts, e)
+                self._retry_later(job, e)
+            return
+
+        session_started(None)
+        self.queue.update(job, status="done", owner=None, video_id=video_id, error=None)
+        stats["uploaded"] += 1
+        logger.info("Video uploaded: https://youtu.be/%s", video_id)
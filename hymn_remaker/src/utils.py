@@ -1,6 +1,11 @@
 import time
+import asyncio
 import logging
+import subprocess
+import httpx
 from functools import wraps
+from .logging_config import log_context
+from .timeouts import HTTP_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
@@ -20,14 +25,133 @@ def retry_request(max_retries=3, delay=1, backoff=2, exceptions=(Exception,)):
             current_delay = delay
             for attempt in range(max_retries + 1):
                 try:
-                    return func(*args, **kwargs)
+                    with log_context(attempt=attempt + 1):
+                        return func(*args, **kwargs)
                 except exceptions as e:
                     if attempt == max_retries:
-                        logger.error(f"Function {func.__name__} failed after {max_retries} retries. Error: {e}")
+                        logger.error("Function %s failed after %d retries. Error: %s", func.__name__, max_retries, e)
                         raise
 
-                    logger.warning(f"Function {func.__name__} failed (attempt {attempt+1}/{max_retries}). Retrying in {current_delay}s... Error: {e}")
+                    logger.warning("Function %s failed (attempt %d/%d). Retrying in %ss... Error: %s", func.__name__, attempt + 1, max_retries, current_delay, e)
                     time.sleep(current_delay)
                     current_delay *= backoff
         return wrapper
     return decorator
+
+def async_retry_request(max_retries=3, delay=1, backoff=2, exceptions=(Exception,)):
+    """
+    Decorator to retry a coroutine function with exponential backoff, without blocking the event loop.
+
+    Args:
+        max_retries (int): Maximum number of retries.
+        delay (int): Initial delay in seconds.
+        backoff (int): Multiplier for delay after each failure.
+        exceptions (tuple): Tuple of exceptions to catch and retry on.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            current_delay = delay
+            for attempt in range(max_retries + 1):
+                try:
+                    with log_context(attempt=attempt + 1):
+                        return await func(*args, **kwargs)
+                except exceptions as e:
+                    if attempt == max_retries:
+                        logger.error("Function %s failed after %d retries. Error: %s", func.__name__, max_retries, e)
+                        raise
+
+                    logger.warning("Function %s failed (attempt %d/%d). Retrying in %ss... Error: %s", func.__name__, attempt + 1, max_retries, current_delay, e)
+                    await asyncio.sleep(current_delay)
+                    current_delay *= backoff
+        return wrapper
+    return decorator
+
+# Read size for streamed HTTP downloads; bounds the per-transfer buffer
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+def stream_to_file(response, path, chunk_size=DOWNLOAD_CHUNK_BYTES):
+    """
+    Write a streamed HTTP response to disk chunk by chunk.
+
+    Args:
+        response (requests.Response): Response opened with stream=True.
+        path (str): Destination file path.
+        chunk_size (int): Bytes read per chunk.
+
+    Returns:
+        int: Number of bytes written.
+    """
+    written = 0
+    try:
+        response.raise_for_status()
+        with open(path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                written += len(chunk)
+    finally:
+        response.close()
+    return written
+
+async def async_download(url, path, client=None, chunk_size=DOWNLOAD_CHUNK_BYTES):
+    """
+    Stream a URL to disk chunk by chunk without blocking the event loop on the network.
+
+    Args:
+        url (str): URL to download.
+        path (str): Destination file path.
+        client (httpx.AsyncClient): Shared client to reuse connections. A temporary one is created if omitted.
+        chunk_size (int): Bytes read per chunk.
+
+    Returns:
+        int: Number of bytes written.
+    """
+    if client is None:
+        async with httpx.AsyncClient(follow_redirects=True, timeout=HTTP_TIMEOUT) as own_client:
+            return await async_download(url, path, client=own_client, chunk_size=chunk_size)
+
+    written = 0
+    async with client.stream("GET", url) as response:
+        response.raise_for_status()
+        with open(path, "wb") as f:
+            async for chunk in response.aiter_bytes(chunk_size=chunk_size):
+                f.write(chunk)
+                written += len(chunk)
+    return written
+
+def kill_process(process):
+    """Kill an asyncio subprocess if it is still running."""
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+async def run_process(cmd):
+    """
+    Run a command without blocking the event loop. If the awaiting task is cancelled
+    (e.g. by a stage deadline) the child process is killed and reaped before the
+    cancellation propagates.
+
+    Args:
+        cmd (list): Command and arguments.
+
+    Returns:
+        bytes: The command's stderr.
+
+    Raises:
+        subprocess.CalledProcessError: If the command exits non-zero.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await process.communicate()
+    except BaseException:
+        kill_process(process)
+        await process.wait()
+        raise
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+    return stderr
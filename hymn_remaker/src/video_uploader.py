@@ -3,19 +3,30 @@ import subprocess
 import logging
 import json
 import time
+import asyncio
+import tempfile
+import threading
 import requests
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
+from .utils import stream_to_file, async_download, run_process
+from .timeouts import HTTP_TIMEOUT, StageTimeout
+from .logging_config import truncate_output
+from .compilation import probe_duration, compute_chapters, ffmetadata_chapters, compilation_filter
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Scopes required for YouTube Data API
 SCOPES = ["https://www.googleapis.com/auth/youtube.upload"]
 
+# Resumable upload chunk size; must be a multiple of 256 KiB
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+
 class VideoProducer:
     def __init__(self, client_secrets_file=None):
         """
@@ -31,8 +42,35 @@ class VideoProducer:
             "client_secrets.json"
         )
         self.youtube = None
-
-    def create_video(self, audio_path, image_url, output_path):
+        # The YouTube client (httplib2) is not thread-safe
+        self._upload_lock = threading.Lock()
+
+    def _ffmpeg_command(self, image_path, audio_path, output_path, copy_audio):
+        """Build the ffmpeg command that muxes a still image with an audio track."""
+        # Loop image, use audio, shortest duration (audio length), aac audio codec, libx264 video codec
+        # tuning for still image
+        if copy_audio:
+            audio_args = ["-c:a", "copy"]
+        else:
+            audio_args = ["-c:a", "aac", "-b:a", "192k"]
+
+        return [
+            "ffmpeg",
+            "-y", # Overwrite output
+            "-hide_banner",
+            "-loglevel", "error", # Only errors reach stderr
+            "-loop", "1",
+            "-i", image_path,
+            "-i", audio_path,
+            "-c:v", "libx264",
+            "-tune", "stillimage",
+            *audio_args,
+            "-pix_fmt", "yuv420p",
+            "-shortest",
+            output_path
+        ]
+
+    def create_video(self, audio_path, image_url, output_path, copy_audio=False):
         """
         Create an MP4 video from an audio file and an image URL using ffmpeg.
 
@@ -40,49 +78,156 @@ class VideoProducer:
             audio_path (str): Path to the input audio file.
             image_url (str): URL of the album art image.
             output_path (str): Path to the output video file.
+            copy_audio (bool): Mux the audio stream as-is instead of re-encoding to AAC.
+                               Use when audio_path is already encoded by AudioProcessor.
         """
-        logger.info(f"Creating video from {audio_path} and {image_url}...")
+        logger.info("Creating video from %s and %s...", audio_path, image_url)
 
-        # 1. Download the image to a temporary file
-        temp_image_path = "temp_art.png"
+        # 1. Stream the image to a unique temporary file so concurrent jobs don't collide
+        fd, temp_image_path = tempfile.mkstemp(suffix=".png")
+        os.close(fd)
         try:
-            response = requests.get(image_url)
-            response.raise_for_status()
-            with open(temp_image_path, 'wb') as f:
-                f.write(response.content)
+            stream_to_file(requests.get(image_url, stream=True, timeout=HTTP_TIMEOUT), temp_image_path)
 
             # 2. Use ffmpeg to combine image and audio
-            # Loop image, use audio, shortest duration (audio length), aac audio codec, libx264 video codec
-            # tuning for still image
-            cmd = [
-                "ffmpeg",
-                "-y", # Overwrite output
-                "-loop", "1",
-                "-i", temp_image_path,
-                "-i", audio_path,
-                "-c:v", "libx264",
-                "-tune", "stillimage",
-                "-c:a", "aac",
-                "-b:a", "192k",
-                "-pix_fmt", "yuv420p",
-                "-shortest",
-                output_path
-            ]
-
-            logger.info(f"Running ffmpeg: {' '.join(cmd)}")
+            cmd = self._ffmpeg_command(temp_image_path, audio_path, output_path, copy_audio)
+
+            logger.debug("Running ffmpeg: %s", " ".join(cmd))
             subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            logger.info(f"Video created at {output_path}")
+            logger.info("Video created at %s", output_path)
+
+        except subprocess.CalledProcessError as e:
+            logger.error("FFmpeg failed: %s", truncate_output(e.stderr))
+            raise
+        except Exception as e:
+            logger.error("Failed to create video: %s", e)
+            raise
+        finally:
+            if os.path.exists(temp_image_path):
+                os.remove(temp_image_path)
+
+    async def acreate_video(self, audio_path, image_url, output_path, copy_audio=False, http_client=None):
+        """
+        Async variant of create_video: httpx download and asyncio subprocess for ffmpeg.
+
+        Args:
+            http_client (httpx.AsyncClient): Optional shared client for the art download.
+        """
+        logger.info("Creating video from %s and %s...", audio_path, image_url)
+
+        fd, temp_image_path = tempfile.mkstemp(suffix=".png")
+        os.close(fd)
+        try:
+            await async_download(image_url, temp_image_path, client=http_client)
+
+            cmd = self._ffmpeg_command(temp_image_path, audio_path, output_path, copy_audio)
+            logger.debug("Running ffmpeg: %s", " ".join(cmd))
+            # ffmpeg is killed if the stage is cancelled
+            await run_process(cmd)
+            logger.info("Video created at %s", output_path)
 
         except subprocess.CalledProcessError as e:
-            logger.error(f"FFmpeg failed: {e.stderr.decode()}")
+            logger.error("FFmpeg failed: %s", truncate_output(e.stderr))
             raise
         except Exception as e:
-            logger.error(f"Failed to create video: {e}")
+            logger.error("Failed to create video: %s", e)
             raise
         finally:
             if os.path.exists(temp_image_path):
                 os.remove(temp_image_path)
 
+    def _compilation_command(self, image_path, audio_paths, metadata_path, output_path, crossfade, sample_rate,
+                             gains_db=None):
+        """Build the single ffmpeg invocation that joins all tracks, embeds chapters and muxes the still image."""
+        graph, audio_label = compilation_filter(len(audio_paths), crossfade, sample_rate, gains_db)
+        # Input 0 is the image, 1..N the tracks, N+1 the chapter metadata
+        metadata_index = str(len(audio_paths) + 1)
+
+        cmd = [
+            "ffmpeg",
+            "-y",
+            "-hide_banner",
+            "-loglevel", "error",
+            "-loop", "1",
+            "-i", image_path,
+        ]
+        for audio_path in audio_paths:
+            cmd.extend(["-i", audio_path])
+        cmd.extend([
+            "-f", "ffmetadata",
+            "-i", metadata_path,
+            "-filter_complex", graph,
+            "-map", "0:v",
+            "-map", f"[{audio_label}]",
+            "-map_metadata", metadata_index,
+            "-map_chapters", metadata_index,
+            "-c:v", "libx264",
+            "-tune", "stillimage",
+            "-c:a", "aac",
+            "-b:a", "192k",
+            "-pix_fmt", "yuv420p",
+            "-shortest",
+            output_path
+        ])
+        return cmd
+
+    def _prepare_compilation(self, tracks, durations, crossfade, title):
+        """Compute chapters and write them to a temporary FFMETADATA file. Returns (chapters, path)."""
+        chapters = compute_chapters([t["title"] for t in tracks], durations, crossfade)
+        fd, metadata_path = tempfile.mkstemp(suffix=".txt")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(ffmetadata_chapters(chapters, title))
+        return chapters, metadata_path
+
+    async def acreate_compilation(self, tracks, image_url, output_path, crossfade=3.0, title=None,
+                                  sample_rate=48000, http_client=None):
+        """
+        Create a single compilation MP4 with crossfades and chapters in one ffmpeg pass.
+
+        Args:
+            tracks (list): [{"audio_path": str, "title": str, "gain_db": float}, ...] in playback
+                           order. "gain_db" is optional and applied in the filter graph, so
+                           unprocessed WAVs can be normalized and encoded in the same pass.
+            image_url (str): URL of the cover image shown for the whole video.
+            output_path (str): Path to the output video file.
+            crossfade (float): Crossfade between consecutive tracks in seconds (0 for hard cuts).
+            title (str): Optional title embedded in the MP4 metadata.
+            sample_rate (int): Sample rate of the compilation audio.
+            http_client (httpx.AsyncClient): Shared client for the cover image download.
+
+        Returns:
+            list: Chapters as returned by compilation.compute_chapters().
+        """
+        if not tracks:
+            raise ValueError("A compilation needs at least one track.")
+
+        logger.info("Creating compilation of %d tracks at %s...", len(tracks), output_path)
+        durations = await asyncio.gather(*(asyncio.to_thread(probe_duration, t["audio_path"]) for t in tracks))
+        chapters, metadata_path = self._prepare_compilation(tracks, list(durations), crossfade, title)
+
+        fd, temp_image_path = tempfile.mkstemp(suffix=".png")
+        os.close(fd)
+        try:
+            await async_download(image_url, temp_image_path, client=http_client)
+
+            cmd = self._compilation_command(
+                temp_image_path, [t["audio_path"] for t in tracks], metadata_path, output_path, crossfade, sample_rate,
+                [t.get("gain_db", 0.0) for t in tracks]
+            )
+            logger.debug("Running ffmpeg: %s", " ".join(cmd))
+            try:
+                await run_process(cmd)
+            except subprocess.CalledProcessError as e:
+                logger.error("FFmpeg failed: %s", truncate_output(e.stderr))
+                raise
+            logger.info("Compilation created at %s", output_path)
+        finally:
+            for path in (temp_image_path, metadata_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+        return chapters
+
     def _get_authenticated_service(self):
         """Authenticate and return the YouTube API service."""
         creds = None
@@ -110,20 +255,54 @@ class VideoProducer:
             with open(token_path, "w") as token:
                 token.write(creds.to_json())
 
-        return build("youtube", "v3", credentials=creds)
+        # A socket timeout keeps a dead connection from blocking next_chunk() forever
+        http = AuthorizedHttp(creds, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+        return build("youtube", "v3", http=http)
 
-    def upload_to_youtube(self, video_path, metadata):
+    def upload_to_youtube(self, video_path, metadata, timeout=None, cancel=None, on_session=None, session_uri=None):
         """
         Upload the video to YouTube.
 
         Args:
             video_path (str): Path to the video file.
             metadata (dict): Metadata dictionary (title, description, tags).
+            timeout (float): Deadline in seconds for the upload itself, checked between chunks.
+            cancel (threading.Event): Stops the upload before the next chunk once set.
+            on_session (callable): Called with the resumable session URI once YouTube has
+                                   accepted the insert, i.e. once it counts against the quota.
+            session_uri (str): Session of an earlier, interrupted attempt to resume instead of
+                               inserting the video again.
 
         Returns:
             str: ID of the uploaded video.
         """
-        logger.info(f"Uploading {video_path} to YouTube...")
+        with self._upload_lock:
+            return self._upload(video_path, metadata, timeout, cancel, on_session, session_uri)
+
+    async def aupload_to_youtube(self, video_path, metadata, on_session=None, session_uri=None):
+        """
+        Async variant of upload_to_youtube; the Google client is blocking, so it runs in a worker thread.
+
+        If the awaiting task is cancelled, the thread stops before its next chunk
+        (a chunk in flight is bounded by the socket timeout). on_session is called on the event loop.
+        """
+        cancel = threading.Event()
+        callback = None
+        if on_session:
+            loop = asyncio.get_running_loop()
+            callback = lambda uri: loop.call_soon_threadsafe(on_session, uri)
+        try:
+            return await asyncio.to_thread(
+                self.upload_to_youtube, video_path, metadata, cancel=cancel, on_session=callback,
+                session_uri=session_uri
+            )
+        except asyncio.CancelledError:
+            cancel.set()
+            raise
+
+    def _upload(self, video_path, metadata, timeout=None, cancel=None, on_session=None, session_uri=None):
+        """Perform the upload; callers must hold _upload_lock."""
+        logger.info("Uploading %s to YouTube...", video_path)
 
         if not self.youtube:
             self.youtube = self._get_authenticated_service()
@@ -140,24 +319,44 @@ class VideoProducer:
             }
         }
 
-        media = MediaFileUpload(video_path, chunksize=-1, resumable=True)
+        # Bounded chunks keep the upload buffer constant instead of proportional to the video size
+        media = MediaFileUpload(video_path, chunksize=UPLOAD_CHUNK_BYTES, resumable=True)
 
+        deadline = time.monotonic() + timeout if timeout else None
         request = self.youtube.videos().insert(
             part="snippet,status",
             body=body,
             media_body=media
         )
+        if session_uri:
+            # In the error state the client first asks YouTube how much of the session it has,
+            # then sends the rest (or returns the video if it was already complete)
+            logger.info("Resuming upload session for %s", video_path)
+            request.resumable_uri = session_uri
+            request._in_error_state = True
 
         response = None
+        session_reported = False
         while response is None:
-            status, response = request.next_chunk()
+            if cancel is not None and cancel.is_set():
+                raise InterruptedError(f"Upload of {video_path} cancelled")
+            if deadline is not None and time.monotonic() > deadline:
+                raise StageTimeout("upload", timeout)
+            try:
+                status, response = request.next_chunk()
+            finally:
+                # The first chunk also opens the session; report it even if that chunk failed
+                if on_session and not session_reported and request.resumable_uri:
+                    session_reported = True
+                    on_session(request.resumable_uri)
             if status:
-                logger.info(f"Uploaded {int(status.progress() * 100)}%")
+                logger.info("Uploaded %d%%", int(status.progress() * 100))
 
-        logger.info(f"Upload complete! Video ID: {response['id']}")
+        logger.info("Upload complete! Video ID: %s", response["id"])
         return response['id']
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     # Test video creation (requires dummy audio)
     producer = VideoProducer()
 
@@ -177,7 +376,7 @@ if __name__ == "__main__":
         try:
             producer.create_video(test_audio, test_image_url, test_output)
         except Exception as e:
-            logger.warning(f"Standard test failed (likely network): {e}")
+            logger.warning("Standard test failed (likely network): %s", e)
             logger.info("Attempting local test...")
             # Create a dummy image
             from PIL import Image
@@ -190,13 +389,17 @@ if __name__ == "__main__":
                     self.content = content
                 def raise_for_status(self):
                     pass
+                def iter_content(self, chunk_size=1):
+                    yield self.content
+                def close(self):
+                    pass
 
             original_get = requests.get
-            def mock_get(url):
+            def mock_get(url, **kwargs):
                 if url == "local_test_url":
                     with open(local_img, "rb") as f:
                         return MockResponse(f.read())
-                return original_get(url)
+                return original_get(url, **kwargs)
 
             requests.get = mock_get
             producer.create_video(test_audio, "local_test_url", test_output)
@@ -0,0 +1,132 @@
+import unittest
+import os
+import sys
+import wave
+import numpy as np
+from unittest.mock import patch, MagicMock, AsyncMock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from hymn_remaker.src.audio_processor import AudioProcessor, read_wav_chunks
+
+def write_sine(path, amplitude, seconds=3.0, sample_rate=48000, channels=2, sample_width=2, freq=997.0):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    signal = amplitude * np.sin(2 * np.pi * freq * t)
+    frames = np.repeat(signal[:, None], channels, axis=1)
+    scale = 2 ** (8 * sample_width - 1) - 1
+    ints = np.round(frames * scale).astype("<i4")
+    if sample_width == 2:
+        raw = ints.astype("<i2").tobytes()
+    else:
+        # Keep the low three bytes of each little-endian int32 for 24-bit PCM
+        raw = ints.view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.setframerate(sample_rate)
+        wav.writeframes(raw)
+
+class TestAudioProcessor(unittest.TestCase):
+    def setUp(self):
+        self.audio_path = "test_sine.wav"
+
+    def tearDown(self):
+        if os.path.exists(self.audio_path):
+            os.remove(self.audio_path)
+
+    def test_full_scale_stereo_sine_is_zero_lufs(self):
+        # BS.1770: a 0 dBFS 997 Hz sine in both channels measures ~0 LUFS
+        write_sine(self.audio_path, amplitude=1.0)
+        stats = AudioProcessor().analyze(self.audio_path)
+        self.assertAlmostEqual(stats["integrated_lufs"], 0.0, delta=0.1)
+        self.assertAlmostEqual(stats["peak_dbfs"], 0.0, delta=0.01)
+
+    def test_24_bit_and_chunking_match(self):
+        write_sine(self.audio_path, amplitude=0.1, sample_width=3)
+        coarse = AudioProcessor(chunk_seconds=2.0).analyze(self.audio_path)
+        fine = AudioProcessor(chunk_seconds=0.1).analyze(self.audio_path)
+        self.assertAlmostEqual(coarse["integrated_lufs"], -20.0, delta=0.1)
+        self.assertAlmostEqual(coarse["integrated_lufs"], fine["integrated_lufs"], places=6)
+
+    def test_silence(self):
+        write_sine(self.audio_path, amplitude=0.0)
+        processor = AudioProcessor()
+        stats = processor.analyze(self.audio_path)
+        self.assertEqual(stats["integrated_lufs"], float("-inf"))
+        self.assertEqual(processor.compute_gain(stats), 1.0)
+
+    def test_gain_capped_by_peak_ceiling(self):
+        processor = AudioProcessor(target_lufs=-14.0, peak_ceiling_db=-1.0)
+        # Loudness wants +10 dB, but the peak only allows +3 dB
+        gain = processor.compute_gain({"integrated_lufs": -24.0, "peak_dbfs": -4.0})
+        self.assertAlmostEqual(20 * np.log10(gain), 3.0)
+
+        peak = AudioProcessor(mode="peak", peak_ceiling_db=-1.0)
+        gain = peak.compute_gain({"integrated_lufs": -24.0, "peak_dbfs": -4.0})
+        self.assertAlmostEqual(20 * np.log10(gain), 3.0)
+
+    @patch('hymn_remaker.src.audio_processor.subprocess.Popen')
+    def test_process_streams_scaled_pcm_to_ffmpeg(self, MockPopen):
+        write_sine(self.audio_path, amplitude=0.1, seconds=1.0)
+        process = MockPopen.return_value
+        process.stderr.read.return_value = b""
+        process.returncode = 0
+        written = []
+        process.stdin.write.side_effect = written.append
+
+        processor = AudioProcessor(mode="peak", peak_ceiling_db=-6.0, codec="opus", sample_rate=24000)
+        stats = processor.process(self.audio_path, "out.ogg")
+
+        cmd = MockPopen.call_args[0][0]
+        self.assertEqual(cmd[0], "ffmpeg")
+        self.assertIn("libopus", cmd)
+        self.assertEqual(cmd[cmd.index("-i") + 2:cmd.index("-i") + 4], ["-ar", "24000"])
+        self.assertEqual(cmd[-1], "out.ogg")
+
+        samples = np.frombuffer(b"".join(written), dtype="<f4")
+        self.assertEqual(samples.size, 48000 * 2)
+        self.assertAlmostEqual(20 * np.log10(np.max(np.abs(samples))), -6.0, delta=0.01)
+        self.assertAlmostEqual(stats["gain_db"], 14.0, delta=0.01)
+
+    def test_opus_sample_rate_validated(self):
+        with self.assertRaises(ValueError):
+            AudioProcessor(codec="opus", sample_rate=44100)
+        AudioProcessor(codec="opus", sample_rate=24000)
+        AudioProcessor(codec="aac", sample_rate=44100)
+
+    def test_read_wav_chunks_shape(self):
+        write_sine(self.audio_path, amplitude=0.5, seconds=1.0, channels=1)
+        chunks = list(read_wav_chunks(self.audio_path, 10000))
+        self.assertEqual(chunks[0].shape, (10000, 1))
+        self.assertEqual(sum(c.shape[0] for c in chunks), 48000)
+
+class TestAudioProcessorAsync(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.audio_path = "test_sine_async.wav"
+
+    def tearDown(self):
+        if os.path.exists(self.audio_path):
+            os.remove(self.audio_path)
+
+    @patch('hymn_remaker.src.audio_processor.asyncio.create_subprocess_exec')
+    async def test_aprocess_streams_scaled_pcm(self, mock_exec):
+        write_sine(self.audio_path, amplitude=0.1, seconds=1.0)
+        written = []
+        process = MagicMock(returncode=0)
+        process.stdin.write.side_effect = written.append
+        process.stdin.drain = AsyncMock()
+        process.stderr.read = AsyncMock(return_value=b"")
+        process.wait = AsyncMock(return_value=0)
+        mock_exec.return_value = process
+
+        processor = AudioProcessor(mode="peak", peak_ceiling_db=-6.0, chunk_seconds=0.25)
+        stats = await processor.aprocess(self.audio_path, "out.m4a")
+
+        self.assertEqual(len(written), 4)
+        samples = np.frombuffer(b"".join(written), dtype="<f4")
+        self.assertEqual(samples.size, 48000 * 2)
+        self.assertAlmostEqual(20 * np.log10(np.max(np.abs(samples))), -6.0, delta=0.01)
+        self.assertAlmostEqual(stats["gain_db"], 14.0, delta=0.01)
+
+if __name__ == '__main__':
+    unittest.main()
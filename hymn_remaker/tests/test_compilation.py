@@ -0,0 +1,81 @@
+import unittest
+import os
+import sys
+from unittest.mock import patch, MagicMock, AsyncMock
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from hymn_remaker.src.compilation import (
+    compute_chapters, chapter_description, ffmetadata_chapters, compilation_filter, compilation_metadata
+)
+from hymn_remaker.src.video_uploader import VideoProducer
+
+class TestCompilation(unittest.TestCase):
+    def test_compute_chapters_with_crossfade(self):
+        chapters = compute_chapters(["A", "B", "C"], [100.0, 60.0, 30.0], crossfade=5.0)
+        self.assertEqual([(c["start"], c["end"]) for c in chapters], [(0.0, 95.0), (95.0, 150.0), (150.0, 180.0)])
+
+    def test_crossfade_longer_than_track(self):
+        with self.assertRaises(ValueError):
+            compute_chapters(["A", "B"], [100.0, 4.0], crossfade=5.0)
+
+    def test_chapter_description(self):
+        chapters = compute_chapters(["Amazing Grace", "Be Thou My Vision", "Abide"], [65.0, 60.0, 3600.0])
+        lines = chapter_description(chapters).splitlines()
+        self.assertEqual(lines[0], "0:00:00 Amazing Grace")
+        self.assertEqual(lines[1], "0:01:05 Be Thou My Vision")
+
+        short = compute_chapters(["A", "B", "C"], [65.0, 60.0, 30.0])
+        self.assertEqual(chapter_description(short).splitlines()[2], "02:05 C")
+
+    def test_ffmetadata_escaping(self):
+        text = ffmetadata_chapters([{"title": "A=B; #1", "start": 0.0, "end": 1.5}], title="Mix")
+        self.assertTrue(text.startswith(";FFMETADATA1\ntitle=Mix\n[CHAPTER]"))
+        self.assertIn("END=1500", text)
+        self.assertIn(r"title=A\=B\; \#1", text)
+
+    def test_compilation_filter(self):
+        graph, label = compilation_filter(3, crossfade=2.0)
+        self.assertEqual(label, "x2")
+        self.assertIn("[a0][a1]acrossfade=d=2.0", graph)
+        self.assertIn("[x1][a2]acrossfade=d=2.0", graph)
+
+        graph, label = compilation_filter(3, crossfade=0)
+        self.assertEqual(label, "aout")
+        self.assertIn("[a0][a1][a2]concat=n=3:v=0:a=1[aout]", graph)
+
+        graph, label = compilation_filter(1, crossfade=2.0)
+        self.assertEqual(label, "a0")
+
+        graph, _ = compilation_filter(2, gains_db=[-3.5, 0.0])
+        self.assertIn("channel_layouts=stereo,volume=-3.50dB[a0]", graph)
+        self.assertIn("channel_layouts=stereo[a1]", graph)
+
+    def test_compilation_metadata_merges_tags(self):
+        chapters = compute_chapters(["A", "B", "C"], [60.0, 60.0, 60.0])
+        metadata = compilation_metadata("Mix", chapters, [{"tags": ["hymn", "house"]}, {"tags": ["house", "remix"]}, {}])
+        self.assertEqual(metadata["title"], "Mix")
+        self.assertEqual(metadata["tags"], ["hymn", "house", "remix"])
+        self.assertIn("Tracklist:\n00:00 A\n01:00 B\n02:00 C", metadata["description"])
+
+class TestCompilationVideo(unittest.IsolatedAsyncioTestCase):
+    @patch('hymn_remaker.src.video_uploader.probe_duration', side_effect=[120.0, 90.0])
+    @patch('hymn_remaker.src.video_uploader.async_download', new_callable=AsyncMock)
+    @patch('hymn_remaker.src.video_uploader.run_process', new_callable=AsyncMock)
+    async def test_create_compilation_single_ffmpeg_call(self, mock_run, mock_download, mock_probe):
+        producer = VideoProducer()
+        tracks = [{"audio_path": "a_remake.wav", "title": "A", "gain_db": 2.0}, {"audio_path": "b_remake.wav", "title": "B"}]
+        chapters = await producer.acreate_compilation(tracks, "http://image.url", "mix.mp4", crossfade=4.0)
+
+        self.assertEqual([c["start"] for c in chapters], [0.0, 116.0])
+        mock_download.assert_awaited_once()
+        mock_run.assert_awaited_once()
+        cmd = mock_run.call_args[0][0]
+        self.assertEqual(cmd.count("-i"), 4)
+        self.assertIn("acrossfade=d=4.0", cmd[cmd.index("-filter_complex") + 1])
+        self.assertIn("volume=2.00dB[a0]", cmd[cmd.index("-filter_complex") + 1])
+        self.assertEqual(cmd[cmd.index("-map_chapters") + 1], "3")
+        self.assertEqual(cmd[-1], "mix.mp4")
+
+if __name__ == '__main__':
+    unittest.main()
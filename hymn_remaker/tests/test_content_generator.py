@@ -2,7 +2,7 @@ import unittest
 import os
 import sys
 import json
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
@@ -56,5 +56,29 @@ class TestContentGenerator(unittest.TestCase):
         call_args = mock_client.images.generate.call_args[1]
         self.assertEqual(call_args["model"], "dall-e-3")
 
+class TestContentGeneratorAsync(unittest.IsolatedAsyncioTestCase):
+    @patch('hymn_remaker.src.content_generator.openai.AsyncOpenAI')
+    @patch('hymn_remaker.src.content_generator.openai.OpenAI')
+    async def test_agenerate_metadata_and_art(self, MockOpenAI, MockAsyncOpenAI):
+        mock_client = MockAsyncOpenAI.return_value
+
+        metadata_response = MagicMock()
+        metadata_response.choices[0].message.content = json.dumps({"title": "Async Title"})
+        mock_client.chat.completions.create = AsyncMock(return_value=metadata_response)
+
+        art_response = MagicMock()
+        art_response.data[0].url = "http://image.url"
+        mock_client.images.generate = AsyncMock(return_value=art_response)
+
+        gen = ContentGenerator(api_key="dummy_key")
+        metadata = await gen.agenerate_metadata("Test Hymn", "Rock")
+        url = await gen.agenerate_art("A beautiful painting")
+
+        self.assertEqual(metadata["title"], "Async Title")
+        self.assertEqual(url, "http://image.url")
+        self.assertEqual(mock_client.chat.completions.create.call_args[1]["model"], "gpt-4-turbo")
+        self.assertEqual(mock_client.images.generate.call_args[1]["model"], "dall-e-3")
+        MockOpenAI.return_value.chat.completions.create.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main()
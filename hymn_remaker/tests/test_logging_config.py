@@ -0,0 +1,118 @@
+import unittest
+import os
+import io
+import sys
+import json
+import logging
+import threading
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from hymn_remaker.src.logging_config import (
+    setup_logging, log_context, update_log_context, get_log_context, truncate_output
+)
+
+class TestLoggingConfig(unittest.TestCase):
+    def setUp(self):
+        self.root = logging.getLogger()
+        self.saved_handlers = list(self.root.handlers)
+        self.saved_level = self.root.level
+        self.stream = io.StringIO()
+
+    def tearDown(self):
+        for handler in list(self.root.handlers):
+            self.root.removeHandler(handler)
+        for handler in self.saved_handlers:
+            self.root.addHandler(handler)
+        self.root.setLevel(self.saved_level)
+
+    def _lines(self, listener):
+        listener.stop()
+        return [line for line in self.stream.getvalue().splitlines() if line]
+
+    def test_json_output_includes_context(self):
+        listener = setup_logging(json_output=True, stream=self.stream)
+        logger = logging.getLogger("test")
+
+        with log_context(hymn="amazing_grace"):
+            update_log_context(stage="render")
+            logger.info("Rendering %s", "a.mid", extra={"bytes": 42})
+        logger.info("outside")
+
+        first, second = [json.loads(line) for line in self._lines(listener)]
+        self.assertEqual(first["message"], "Rendering a.mid")
+        self.assertEqual(first["hymn"], "amazing_grace")
+        self.assertEqual(first["stage"], "render")
+        self.assertEqual(first["bytes"], 42)
+        self.assertEqual(first["level"], "INFO")
+        self.assertNotIn("hymn", second)
+
+    def test_json_output_includes_exception(self):
+        listener = setup_logging(json_output=True, stream=self.stream)
+        try:
+            raise ValueError("bad hymn")
+        except ValueError:
+            logging.getLogger("test").exception("Failed %s", "h1")
+
+        entry, = [json.loads(line) for line in self._lines(listener)]
+        self.assertEqual(entry["message"], "Failed h1")
+        self.assertIn("ValueError: bad hymn", entry["exception"])
+
+    def test_repeated_setup_replaces_listener(self):
+        first = setup_logging(stream=self.stream)
+        logging.getLogger("test").warning("one")
+        second = setup_logging(stream=self.stream)
+        logging.getLogger("test").warning("two")
+
+        self.assertIsNone(first._thread)
+        self.assertEqual(len(self.root.handlers), 1)
+        lines = self._lines(second)
+        self.assertEqual(len(lines), 2)
+        # Stopping again, e.g. from the exit hook, is harmless
+        second.stop()
+        first.stop()
+
+    def test_text_output_prefixes_context(self):
+        listener = setup_logging(stream=self.stream)
+        with log_context(hymn="h1", attempt=2):
+            logging.getLogger("test").warning("retrying")
+
+        line, = self._lines(listener)
+        self.assertIn("[hymn=h1 attempt=2] retrying", line)
+
+    def test_context_is_per_thread(self):
+        seen = {}
+
+        def job(name):
+            with log_context(hymn=name):
+                seen[name] = get_log_context()["hymn"]
+
+        threads = [threading.Thread(target=job, args=(f"h{i}",)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(seen, {f"h{i}": f"h{i}" for i in range(4)})
+        self.assertEqual(get_log_context(), {})
+
+    def test_disabled_level_is_not_formatted(self):
+        listener = setup_logging(level="WARNING", stream=self.stream)
+
+        class Exploding:
+            def __str__(self):
+                raise AssertionError("formatted eagerly")
+
+        logging.getLogger("test").info("value: %s", Exploding())
+        self.assertEqual(self._lines(listener), [])
+
+    def test_truncate_output_keeps_tail(self):
+        self.assertEqual(truncate_output(b"short\n"), "short")
+        self.assertEqual(truncate_output(None), "")
+
+        text = truncate_output("x" * 5000 + "ERROR at end", limit=100)
+        self.assertTrue(text.endswith("ERROR at end"))
+        self.assertIn("4912 chars truncated", text)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import os
+import sys
+import asyncio
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from hymn_remaker.src.memory import (
+    AsyncMemoryBudget, parse_size, estimate_job_bytes, estimate_resident_bytes, JOB_OVERHEAD_BYTES
+)
+from hymn_remaker.src.audio_processor import AudioProcessor
+from hymn_remaker.src.remaker import ReplicateBackend, LocalMusicGenBackend
+
+class TestMemory(unittest.TestCase):
+    def test_parse_size(self):
+        self.assertEqual(parse_size("1024"), 1024)
+        self.assertEqual(parse_size("512K"), 512 * 1024)
+        self.assertEqual(parse_size("1.5G"), int(1.5 * 1024 ** 3))
+        self.assertEqual(parse_size("256MiB"), 256 * 1024 ** 2)
+        with self.assertRaises(ValueError):
+            parse_size("lots")
+
+    def test_streamed_estimate_is_independent_of_file_size(self):
+        estimate = estimate_job_bytes(AudioProcessor(chunk_seconds=1.0), backends=[ReplicateBackend()])
+        self.assertGreater(estimate, JOB_OVERHEAD_BYTES)
+        self.assertLess(estimate, 64 * 1024 * 1024)
+
+    def test_local_melody_estimate_scales_with_input(self):
+        processor = AudioProcessor(chunk_seconds=1.0)
+        melody = LocalMusicGenBackend("facebook/musicgen-melody")
+        with tempfile.NamedTemporaryFile(suffix=".wav") as small, tempfile.NamedTemporaryFile(suffix=".wav") as large:
+            small.write(b"\0" * 1024 * 1024)
+            large.write(b"\0" * 10 * 1024 * 1024)
+            small.flush()
+            large.flush()
+            small_estimate = estimate_job_bytes(processor, [melody], base_wav_path=small.name)
+            large_estimate = estimate_job_bytes(processor, [melody], base_wav_path=large.name)
+        self.assertAlmostEqual(large_estimate - small_estimate, 8 * 9 * 1024 * 1024)
+        # Replicate in the candidate list doesn't lower the estimate
+        self.assertEqual(
+            estimate_job_bytes(processor, [ReplicateBackend(), melody]), estimate_job_bytes(processor, [melody])
+        )
+
+    def test_resident_bytes_for_local_models(self):
+        self.assertEqual(estimate_resident_bytes([ReplicateBackend()]), 0)
+        self.assertGreater(estimate_resident_bytes([LocalMusicGenBackend("facebook/musicgen-large")]),
+                           estimate_resident_bytes([LocalMusicGenBackend("facebook/musicgen-small")]))
+
+class TestAsyncMemoryBudget(unittest.IsolatedAsyncioTestCase):
+    async def test_waits_for_release(self):
+        budget = AsyncMemoryBudget(max_bytes=100)
+        await budget.acquire(60)
+
+        async def second_job():
+            async with budget.reserve(60):
+                return budget.in_flight
+
+        task = asyncio.create_task(second_job())
+        await asyncio.sleep(0.01)
+        self.assertFalse(task.done())
+
+        await budget.release(60)
+        self.assertEqual(await task, 60)
+        self.assertEqual(budget.in_flight, 0)
+
+    async def test_oversized_job_admitted_when_idle(self):
+        budget = AsyncMemoryBudget(max_bytes=10)
+        async with budget.reserve(50):
+            self.assertEqual(budget.in_flight, 50)
+        self.assertEqual(budget.in_flight, 0)
+
+    async def test_unlimited(self):
+        budget = AsyncMemoryBudget()
+        await budget.acquire(10 ** 12)
+        await budget.acquire(10 ** 12)
+        self.assertEqual(budget.in_flight, 2 * 10 ** 12)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from hymn_remaker.src.planner import PipelinePlanner, format_plan, YOUTUBE_INSERT_UNITS
+from hymn_remaker.src.remaker import MusicRemaker
+
+class TestPipelinePlanner(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _touch(self, name, size=0):
+        with open(os.path.join(self.output_dir, name), "wb") as f:
+            f.write(b"\0" * size)
+
+    def _actions(self, hymn):
+        return {s["stage"]: s["action"] for s in hymn["stages"]}
+
+    def test_fresh_hymn_runs_everything_but_upload(self):
+        plan = PipelinePlanner(self.output_dir).plan(["input/amazing_grace.mid"])
+        actions = self._actions(plan["hymns"][0])
+
+        self.assertEqual(plan["hymns"][0]["name"], "amazing_grace")
+        self.assertEqual(actions["render"], "run")
+        self.assertEqual(actions["remake"], "run")
+        self.assertEqual(actions["upload"], "skip")
+        self.assertEqual(plan["totals"]["calls"], {"replicate": 1, "openai": 2})
+        self.assertEqual(plan["totals"]["youtube_quota_units"], 0)
+
+    def test_existing_outputs_are_skipped_and_measured(self):
+        self._touch("hymn_base.wav", size=1000)
+        self._touch("hymn_remake.wav")
+        self._touch("hymn.mp4", size=5000)
+
+        planner = PipelinePlanner(self.output_dir, skip_render=True, skip_remake=False, upload=True)
+        plan = planner.plan(["hymn.mid"])
+        actions = self._actions(plan["hymns"][0])
+        stages = {s["stage"]: s for s in plan["hymns"][0]["stages"]}
+
+        self.assertEqual(actions["render"], "skip")
+        self.assertEqual(actions["remake"], "run")
+        self.assertEqual(stages["remake"]["upload_bytes"], 1000)
+        self.assertEqual(stages["upload"]["upload_bytes"], 5000)
+        self.assertEqual(plan["totals"]["youtube_quota_units"], YOUTUBE_INSERT_UNITS)
+
+    def test_remake_is_costed_on_the_routed_backend(self):
+        self._touch("hymn_base.wav", size=1000)
+        local = MusicRemaker(backends=["local"])
+        plan = PipelinePlanner(self.output_dir, remaker=local).plan(["hymn.mid"])
+        remake = {s["stage"]: s for s in plan["hymns"][0]["stages"]}["remake"]
+
+        self.assertEqual(remake["backend"], "local")
+        self.assertEqual((remake["calls"], remake["upload_bytes"], remake["download_bytes"]), (0, 0, 0))
+        self.assertNotIn("replicate", plan["totals"]["calls"])
+        self.assertEqual(plan["totals"]["gpu_seconds"], 0)
+        self.assertEqual(remake["seconds"], round(local.backends[0].estimate_latency(30)))
+
+        replicate = MusicRemaker(backends=["replicate"])
+        plan = PipelinePlanner(self.output_dir, remaker=replicate).plan(["hymn.mid"])
+        self.assertEqual(plan["totals"]["calls"]["replicate"], 1)
+        self.assertGreater(plan["totals"]["cost"], 0)
+
+    def test_failed_remake_fails_its_dependents(self):
+        capped = MusicRemaker(backends=["replicate"], policy="cost-capped", max_cost=0.0001)
+        planner = PipelinePlanner(self.output_dir, upload=True, remaker=capped, compilation=True)
+        plan = planner.plan(["hymn.mid"])
+        actions = self._actions(plan["hymns"][0])
+
+        self.assertEqual({s: actions[s] for s in ("remake", "normalize", "video", "upload")},
+                         {"remake": "fail", "normalize": "fail", "video": "fail", "upload": "fail"})
+        self.assertEqual((actions["render"], actions["metadata"], actions["art"]), ("run", "run", "run"))
+        self.assertEqual(plan["totals"]["fail"], 4)
+        # Nothing downstream of the failure is counted: only metadata and art call OpenAI
+        self.assertEqual(plan["totals"]["calls"], {"openai": 2})
+        self.assertEqual(plan["totals"]["youtube_quota_units"], 0)
+        self.assertEqual((plan["totals"]["upload_bytes"], plan["totals"]["download_bytes"]), (0, 0))
+        # No hymn reaches the compilation
+        self.assertEqual({s["stage"]: s["action"] for s in plan["compilation"]["stages"]},
+                         {"art": "skip", "compilation": "skip", "upload": "skip"})
+        self.assertIn("no remake backend", format_plan(plan))
+
+    def test_without_track_videos_no_art_is_generated(self):
+        plan = PipelinePlanner(self.output_dir, upload=True, track_videos=False).plan(["hymn.mid"])
+        actions = self._actions(plan["hymns"][0])
+        self.assertEqual((actions["art"], actions["video"], actions["upload"]), ("skip", "skip", "skip"))
+        self.assertEqual(actions["metadata"], "run")
+        self.assertEqual(plan["totals"]["calls"]["openai"], 1)
+
+    def test_compilation_is_planned(self):
+        hymns = ["a.mid", "b.mid", "c.mid"]
+        plain = PipelinePlanner(self.output_dir, upload=True, track_videos=False).plan(hymns)
+        self.assertIsNone(plain["compilation"])
+
+        plan = PipelinePlanner(self.output_dir, upload=True, track_videos=False, compilation=True).plan(hymns)
+        stages = {s["stage"]: s for s in plan["compilation"]["stages"]}
+        self.assertEqual({s: stages[s]["action"] for s in stages}, {"art": "run", "compilation": "run", "upload": "run"})
+        self.assertEqual(plan["totals"]["calls"]["openai"], 3 + 1)
+        self.assertEqual(plan["totals"]["calls"]["youtube"], 1)
+        self.assertEqual(plan["totals"]["youtube_quota_units"], YOUTUBE_INSERT_UNITS)
+        self.assertIn("compilation: art=run compilation=run upload=run", format_plan(plan))
+
+        no_upload = PipelinePlanner(self.output_dir, compilation=True).plan(hymns)
+        self.assertEqual(no_upload["totals"]["youtube_quota_units"], 0)
+
+    def test_skip_flags_require_existing_files(self):
+        planner = PipelinePlanner(self.output_dir, skip_render=True, skip_remake=True)
+        actions = self._actions(planner.plan(["hymn.mid"])["hymns"][0])
+        self.assertEqual(actions["render"], "run")
+        self.assertEqual(actions["remake"], "run")
+
+    def test_plan_does_not_load_service_clients(self):
+        main_path = os.path.join(os.path.dirname(__file__), "..", "main.py")
+        script = (
+            "import sys, runpy\n"
+            f"sys.argv = ['main.py', '--plan', '--input-dir', {self.output_dir!r}, '--output-dir', {self.output_dir!r}]\n"
+            "try:\n"
+            f"    runpy.run_path({main_path!r}, run_name='__main__')\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print(sorted(m for m in ('scipy', 'openai', 'googleapiclient', 'replicate') if m in sys.modules))\n"
+        )
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip().splitlines()[-1], "[]")
+
+    def test_large_batch_is_fast(self):
+        midi_files = [f"input/hymn_{i}.mid" for i in range(5000)]
+        start = time.perf_counter()
+        plan = PipelinePlanner(self.output_dir, upload=True).plan(midi_files)
+        text = format_plan(plan)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual(plan["totals"]["hymns"], 5000)
+        self.assertIn("replicate=5000", text)
+
+if __name__ == '__main__':
+    unittest.main()
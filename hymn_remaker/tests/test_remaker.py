@@ -1,11 +1,29 @@
 import unittest
 import os
 import sys
-from unittest.mock import patch, MagicMock
+import asyncio
+import time
+import httpx
+import numpy as np
+from unittest.mock import patch, MagicMock, AsyncMock
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
-from hymn_remaker.src.remaker import MusicRemaker
+from hymn_remaker.src.remaker import MusicRemaker, RemakeBackend, ReplicateBackend, LocalMusicGenBackend
+
+class FakeBackend(RemakeBackend):
+    def __init__(self, name, result=None, error=None, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.result = result
+        self.error = error
+        self.calls = 0
+
+    def remake(self, audio_path, prompt, duration):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.result
 
 class TestMusicRemaker(unittest.TestCase):
     def setUp(self):
@@ -18,9 +36,9 @@ class TestMusicRemaker(unittest.TestCase):
         if os.path.exists(self.audio_path):
             os.remove(self.audio_path)
 
-    @patch('hymn_remaker.src.remaker.replicate')
-    def test_remake_calls_replicate_run(self, mock_replicate):
-        mock_replicate.run.return_value = "http://example.com/remake.wav"
+    @patch('replicate.run')
+    def test_remake_calls_replicate_run(self, mock_run):
+        mock_run.return_value = "http://example.com/remake.wav"
 
         # Instantiate with a dummy token
         remaker = MusicRemaker(api_token="dummy_token")
@@ -28,13 +46,14 @@ class TestMusicRemaker(unittest.TestCase):
         url = remaker.remake(self.audio_path, "Techno")
 
         self.assertEqual(url, "http://example.com/remake.wav")
-        mock_replicate.run.assert_called_once()
+        mock_run.assert_called_once()
 
         # Verify the args passed to run
-        args, kwargs = mock_replicate.run.call_args
+        args, kwargs = mock_run.call_args
         self.assertIn("meta/musicgen", args[0])
         self.assertIn("prompt", kwargs['input'])
         self.assertEqual(kwargs['input']['prompt'], "Techno")
+        self.assertFalse(kwargs['use_file_output'])
 
     def test_missing_token_warning(self):
         with patch.dict(os.environ, {}, clear=True):
@@ -42,5 +61,200 @@ class TestMusicRemaker(unittest.TestCase):
             remaker = MusicRemaker()
             self.assertIsNone(remaker.api_token)
 
+    def test_failover_to_next_backend(self):
+        broken = FakeBackend("remote", error=RuntimeError("queue full"))
+        local = FakeBackend("local", result="/tmp/remake.wav")
+        remaker = MusicRemaker(api_token="dummy_token", backends=[broken, local])
+
+        self.assertEqual(remaker.remake(self.audio_path, "Techno"), "/tmp/remake.wav")
+        self.assertEqual(broken.calls, 1)
+        self.assertEqual(local.calls, 1)
+
+    def test_all_backends_fail(self):
+        remaker = MusicRemaker(api_token="dummy_token", backends=[FakeBackend("a", error=ValueError("boom"))])
+        with self.assertRaises(ValueError):
+            remaker.remake(self.audio_path, "Techno")
+
+    def test_least_latency_prefers_local_for_short_jobs(self):
+        remote = FakeBackend("remote", overhead=30.0, per_second=1.0)
+        local = FakeBackend("local", overhead=0.0, per_second=3.0)
+        remaker = MusicRemaker(api_token="dummy_token", backends=[remote, local], policy="least-latency")
+
+        self.assertEqual([b.name for b in remaker.route(5)], ["local", "remote"])
+        self.assertEqual([b.name for b in remaker.route(60)], ["remote", "local"])
+
+    def test_latency_estimate_learns_from_runs(self):
+        backend = FakeBackend("remote", overhead=30.0, per_second=1.0)
+        backend.record_latency(duration=10, elapsed=110.0)
+        self.assertAlmostEqual(backend.overhead, 30.0 + 0.3 * (100.0 - 30.0))
+
+    def test_failures_and_slow_runs_raise_the_estimate(self):
+        backend = FakeBackend("remote", overhead=30.0, per_second=1.0)
+        backend.record_failure(duration=10, elapsed=5.0)
+        self.assertGreater(backend.overhead, 30.0)
+
+        overhead = backend.overhead
+        # A cancelled run's elapsed time is a lower bound: short ones say nothing
+        backend.record_unfinished(duration=10, elapsed=1.0)
+        self.assertEqual(backend.overhead, overhead)
+        backend.record_unfinished(duration=10, elapsed=500.0)
+        self.assertGreater(backend.overhead, overhead)
+
+    def test_least_latency_probes_other_backends(self):
+        fast = FakeBackend("fast", overhead=0.0)
+        slow = FakeBackend("slow", overhead=100.0, result="/tmp/remake.wav")
+        remaker = MusicRemaker(api_token="dummy_token", backends=[fast, slow], policy="least-latency",
+                               exploration_rate=1.0)
+
+        self.assertEqual(remaker.remake(self.audio_path, "Techno"), "/tmp/remake.wav")
+        self.assertEqual((fast.calls, slow.calls), (0, 1))
+        # The planner's view stays deterministic
+        self.assertEqual([b.name for b in remaker.route(30)], ["fast", "slow"])
+
+        remaker.exploration_rate = 0.0
+        self.assertEqual([b.name for b in remaker._candidates(self.audio_path, 30)], ["fast", "slow"])
+
+    def test_cost_capped_filters_and_orders_by_cost(self):
+        pricey = FakeBackend("pricey", cost_per_second=1.0)
+        cheap = FakeBackend("cheap", cost_per_second=0.01)
+        free = FakeBackend("free", cost_per_second=0.0)
+        remaker = MusicRemaker(api_token="dummy_token", backends=[pricey, cheap, free], policy="cost-capped", max_cost=1.0)
+
+        self.assertEqual([b.name for b in remaker.route(30)], ["free", "cheap"])
+
+        remaker.max_cost = -1
+        with self.assertRaises(RuntimeError):
+            remaker.remake(self.audio_path, "Techno")
+
+    def test_unknown_backend_or_policy(self):
+        with self.assertRaises(ValueError):
+            MusicRemaker(api_token="dummy_token", backends=["nope"])
+        with self.assertRaises(ValueError):
+            MusicRemaker(api_token="dummy_token", policy="random")
+
+    def test_local_backend_is_lazy(self):
+        # Constructing the backend must not import torch/transformers or download a model
+        backend = LocalMusicGenBackend()
+        self.assertIsNone(backend._model)
+        self.assertTrue(backend.melody)
+        self.assertFalse(LocalMusicGenBackend("facebook/musicgen-small").melody)
+
+    def test_backend_options_reach_the_backend(self):
+        remaker = MusicRemaker(api_token="dummy_token", backends=["local"],
+                               backend_options={"local": {"model_name": "facebook/musicgen-small"}})
+        self.assertEqual(remaker.backends[0].model_name, "facebook/musicgen-small")
+
+    def test_text_only_checkpoint_warns(self):
+        backend = LocalMusicGenBackend("facebook/musicgen-small")
+        backend._model = MagicMock()
+        backend._model.config.audio_encoder.sampling_rate = 32000
+        backend._model.config.audio_encoder.frame_rate = 50
+        backend._model.generate.return_value[0, 0].cpu.return_value.numpy.return_value = np.zeros(320, dtype=np.float32)
+        backend._processor = MagicMock()
+
+        with self.assertLogs("hymn_remaker.src.remaker", level="WARNING") as logs:
+            output_path = backend.remake(self.audio_path, "Techno", 1)
+        os.remove(output_path)
+
+        self.assertIn("without melody conditioning", "\n".join(logs.output))
+
+class TestMusicRemakerAsync(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.audio_path = "test_input_async.wav"
+        with open(self.audio_path, "wb") as f:
+            f.write(b'RIFF....WAVEfmt ....data....')
+
+    def tearDown(self):
+        if os.path.exists(self.audio_path):
+            os.remove(self.audio_path)
+
+    @patch('replicate.run')
+    @patch('replicate.predictions')
+    async def test_aremake_creates_prediction(self, mock_predictions, mock_run):
+        prediction = MagicMock(status="succeeded", output="http://example.com/remake.wav")
+        prediction.async_wait = AsyncMock()
+        mock_predictions.async_create = AsyncMock(return_value=prediction)
+
+        remaker = MusicRemaker(api_token="dummy_token")
+        url = await remaker.aremake(self.audio_path, "Techno")
+
+        self.assertEqual(url, "http://example.com/remake.wav")
+        mock_run.assert_not_called()
+        kwargs = mock_predictions.async_create.call_args.kwargs
+        self.assertEqual(kwargs['version'], ReplicateBackend.model.split(":")[1])
+        self.assertEqual(kwargs['input']['prompt'], "Techno")
+
+    @patch('replicate.predictions')
+    async def test_cancelled_aremake_cancels_prediction(self, mock_predictions):
+        async def hang():
+            await asyncio.sleep(3600)
+
+        prediction = MagicMock(id="p1", status="processing")
+        prediction.async_wait = AsyncMock(side_effect=hang)
+        prediction.async_cancel = AsyncMock()
+        mock_predictions.async_create = AsyncMock(return_value=prediction)
+
+        remaker = MusicRemaker(api_token="dummy_token")
+        task = asyncio.ensure_future(remaker.aremake(self.audio_path, "Techno"))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        prediction.async_cancel.assert_awaited_once()
+
+    @patch('hymn_remaker.src.utils.asyncio.sleep', new_callable=AsyncMock)
+    @patch('replicate.predictions')
+    async def test_poll_errors_keep_polling_the_same_prediction(self, mock_predictions, mock_sleep):
+        prediction = MagicMock(id="p1", status="succeeded", output="http://example.com/remake.wav")
+        prediction.async_wait = AsyncMock(side_effect=[httpx.ReadTimeout("poll"), None])
+        prediction.async_cancel = AsyncMock()
+        mock_predictions.async_create = AsyncMock(return_value=prediction)
+
+        backend = ReplicateBackend()
+        self.assertEqual(await backend.aremake(self.audio_path, "Techno", 30), "http://example.com/remake.wav")
+        mock_predictions.async_create.assert_awaited_once()
+        prediction.async_cancel.assert_not_awaited()
+
+    @patch('hymn_remaker.src.utils.asyncio.sleep', new_callable=AsyncMock)
+    @patch('replicate.predictions')
+    async def test_failed_polling_cancels_prediction(self, mock_predictions, mock_sleep):
+        prediction = MagicMock(id="p1", status="processing")
+        prediction.async_wait = AsyncMock(side_effect=httpx.ReadTimeout("poll"))
+        prediction.async_cancel = AsyncMock()
+        mock_predictions.async_create = AsyncMock(return_value=prediction)
+
+        with self.assertRaises(httpx.ReadTimeout):
+            await ReplicateBackend().aremake(self.audio_path, "Techno", 30)
+        # One prediction only, cancelled rather than left running
+        mock_predictions.async_create.assert_awaited_once()
+        prediction.async_cancel.assert_awaited_once()
+
+    async def test_aremake_failover_and_thread_fallback(self):
+        # FakeBackend only implements the blocking remake; the base aremake runs it in a thread
+        broken = FakeBackend("remote", error=RuntimeError("queue full"))
+        local = FakeBackend("local", result="/tmp/remake.wav")
+        remaker = MusicRemaker(api_token="dummy_token", backends=[broken, local])
+
+        self.assertEqual(await remaker.aremake(self.audio_path, "Techno"), "/tmp/remake.wav")
+        self.assertEqual(broken.calls, 1)
+
+    async def test_local_generations_are_serialized(self):
+        backend = LocalMusicGenBackend()
+        running = []
+        peak = []
+
+        def generate(audio_path, prompt, duration, cancel):
+            running.append(1)
+            peak.append(len(running))
+            time.sleep(0.05)
+            running.pop()
+            return "/tmp/remake.wav"
+
+        with patch.object(backend, "_generate", side_effect=generate):
+            results = await asyncio.gather(*(backend.aremake(self.audio_path, "Techno", 5) for _ in range(3)))
+
+        self.assertEqual(results, ["/tmp/remake.wav"] * 3)
+        self.assertEqual(max(peak), 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import os
+import sys
+import asyncio
+import time
+from unittest.mock import patch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from hymn_remaker.src.timeouts import StageTimeout, run_stage, parse_stage_timeouts, DEFAULT_STAGE_TIMEOUTS
+from hymn_remaker.src.utils import run_process
+
+class TestParseStageTimeouts(unittest.TestCase):
+    def test_overrides(self):
+        timeouts = parse_stage_timeouts(["remake=600", "upload=0"])
+        self.assertEqual(timeouts["remake"], 600)
+        self.assertIsNone(timeouts["upload"])
+        self.assertEqual(timeouts["render"], DEFAULT_STAGE_TIMEOUTS["render"])
+
+    def test_all(self):
+        timeouts = parse_stage_timeouts(["all=30", "remake=900"])
+        self.assertEqual(timeouts["video"], 30)
+        self.assertEqual(timeouts["remake"], 900)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            parse_stage_timeouts(["remix=10"])
+        with self.assertRaises(ValueError):
+            parse_stage_timeouts(["remake"])
+
+class TestRunStage(unittest.IsolatedAsyncioTestCase):
+    async def test_timeout_cancels_stage(self):
+        cleaned_up = asyncio.Event()
+
+        async def hung_stage():
+            try:
+                await asyncio.sleep(3600)
+            finally:
+                cleaned_up.set()
+
+        with self.assertRaises(StageTimeout) as ctx:
+            await run_stage("remake", hung_stage(), {"remake": 0.01})
+        self.assertEqual(ctx.exception.stage, "remake")
+        # Cleanup has already run when the timeout is raised
+        self.assertTrue(cleaned_up.is_set())
+
+    async def test_inner_timeout_error_is_not_a_stage_timeout(self):
+        async def socket_timeout():
+            raise TimeoutError("read timed out")
+
+        with self.assertRaises(TimeoutError) as ctx:
+            await run_stage("download", socket_timeout(), {"download": 10})
+        self.assertNotIsInstance(ctx.exception, StageTimeout)
+
+    async def test_no_deadline(self):
+        async def stage():
+            return "done"
+
+        self.assertEqual(await run_stage("video", stage(), {"video": None}), "done")
+        self.assertEqual(await run_stage("video", stage()), "done")
+
+    async def test_cancelled_process_is_killed(self):
+        created = []
+        original = asyncio.create_subprocess_exec
+
+        async def spy(*args, **kwargs):
+            process = await original(*args, **kwargs)
+            created.append(process)
+            return process
+
+        cmd = [sys.executable, "-c", "import time; time.sleep(30)"]
+        start = time.monotonic()
+        with patch('hymn_remaker.src.utils.asyncio.create_subprocess_exec', side_effect=spy):
+            with self.assertRaises(StageTimeout):
+                await run_stage("video", run_process(cmd), {"video": 0.5})
+
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertIsNotNone(created[0].returncode)
+
+if __name__ == '__main__':
+    unittest.main()
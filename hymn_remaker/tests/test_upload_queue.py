@@ -0,0 +1,336 @@
+import unittest
+import os
+import sys
+import asyncio
+import time
+import tempfile
+from datetime import datetime
+from unittest.mock import MagicMock, AsyncMock, ANY
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+from hymn_remaker.src.upload_queue import (
+    UploadQueue, UploadScheduler, is_quota_error, is_rate_limit_error, is_permanent_error, QUOTA_TIMEZONE
+)
+
+class HttpError(Exception):
+    def __init__(self, status, content=b""):
+        super().__init__(f"HTTP {status}")
+        self.resp = MagicMock(status=status)
+        self.content = content
+
+class ReasonError(HttpError):
+    def __init__(self, status, reason):
+        super().__init__(status, ('{"error": {"errors": [{"reason": "%s"}]}}' % reason).encode())
+
+class QuotaError(ReasonError):
+    def __init__(self):
+        super().__init__(403, "quotaExceeded")
+
+class Clock:
+    def __init__(self, *args):
+        self.now = datetime(*args, tzinfo=QUOTA_TIMEZONE)
+
+    def __call__(self):
+        return self.now
+
+class TestUploadQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "queue.json")
+        self.clock = Clock(2026, 10, 19, 15, 0)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_priority_order_and_persistence(self):
+        queue = UploadQueue(self.path, now=self.clock)
+        queue.enqueue("a.mp4", {"title": "A"})
+        queue.enqueue("b.mp4", {"title": "B"}, priority=5)
+        queue.enqueue("c.mp4", {"title": "C"})
+        queue.enqueue("a.mp4", {"title": "A"})  # duplicate is ignored
+
+        reloaded = UploadQueue(self.path, now=self.clock)
+        self.assertEqual([job["video_path"] for job in reloaded.pending()], ["b.mp4", "a.mp4", "c.mp4"])
+
+    def test_regenerated_video_is_uploaded_again(self):
+        video = os.path.join(self.tmp.name, "a.mp4")
+        with open(video, "wb") as f:
+            f.write(b"v1")
+        queue = UploadQueue(self.path, now=self.clock)
+        first = queue.enqueue(video, {})
+        queue.update(first, status="done", video_id="id1")
+
+        # Same file: already uploaded
+        self.assertIs(queue.enqueue(video, {}), first)
+
+        with open(video, "wb") as f:
+            f.write(b"v2 regenerated")
+        second = queue.enqueue(video, {})
+        self.assertIsNot(second, first)
+        self.assertEqual(second["status"], "pending")
+
+    def test_interrupted_upload_is_retried(self):
+        queue = UploadQueue(self.path, now=self.clock)
+        job = queue.enqueue("a.mp4", {})
+        queue.update(job, status="uploading")
+        self.assertEqual(UploadQueue(self.path, now=self.clock).next_job()["video_path"], "a.mp4")
+
+    def test_quota_resets_at_pacific_midnight(self):
+        queue = UploadQueue(self.path, daily_quota=3200, now=self.clock)
+        queue.charge()
+        queue.charge()
+        self.assertFalse(queue.can_upload())
+        self.assertEqual(queue.next_reset(), datetime(2026, 10, 20, tzinfo=QUOTA_TIMEZONE))
+
+        self.clock.now = datetime(2026, 10, 20, 0, 1, tzinfo=QUOTA_TIMEZONE)
+        self.assertEqual(queue.remaining(), 3200)
+
+    def test_is_quota_error(self):
+        self.assertTrue(is_quota_error(QuotaError()))
+        self.assertFalse(is_quota_error(ValueError("boom")))
+
+    def test_is_permanent_error(self):
+        self.assertTrue(is_permanent_error(HttpError(400)))
+        self.assertTrue(is_permanent_error(HttpError(401)))
+        self.assertFalse(is_permanent_error(HttpError(429)))
+        self.assertFalse(is_permanent_error(HttpError(503)))
+        self.assertFalse(is_permanent_error(ConnectionResetError()))
+
+    def test_rate_and_upload_limit_reasons(self):
+        for reason in ("rateLimitExceeded", "userRateLimitExceeded"):
+            error = ReasonError(403, reason)
+            self.assertTrue(is_rate_limit_error(error), reason)
+            self.assertFalse(is_permanent_error(error), reason)
+            self.assertFalse(is_quota_error(error), reason)
+
+        upload_limit = ReasonError(400, "uploadLimitExceeded")
+        self.assertTrue(is_quota_error(upload_limit))
+        self.assertFalse(is_rate_limit_error(upload_limit))
+        self.assertFalse(is_quota_error(ReasonError(403, "forbidden")))
+        self.assertTrue(is_permanent_error(ReasonError(403, "forbidden")))
+
+    def test_claimed_job_is_not_taken_by_another_run(self):
+        queue = UploadQueue(self.path, now=self.clock)
+        job = queue.enqueue("a.mp4", {})
+        other = UploadQueue(self.path, now=self.clock)
+        other_job = other.next_job()
+
+        self.assertTrue(queue.claim(job))
+        # The other run re-reads the file before claiming and sees the upload in progress
+        self.assertFalse(other.claim(other_job))
+        self.assertIsNone(other.next_job())
+        # A live owner's upload is not reset by a run that starts meanwhile
+        self.assertIsNone(UploadQueue(self.path, now=self.clock).next_job())
+
+    def test_quota_is_shared_between_runs(self):
+        first = UploadQueue(self.path, daily_quota=3200, now=self.clock)
+        second = UploadQueue(self.path, daily_quota=3200, now=self.clock)
+        first.charge()
+        second.charge()
+        self.assertFalse(first.can_upload())
+
+class TestUploadScheduler(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.clock = Clock(2026, 10, 19, 15, 0)
+        self.videos = []
+        for name in ("a", "b", "c", "d"):
+            path = os.path.join(self.tmp.name, f"{name}.mp4")
+            open(path, "wb").close()
+            self.videos.append(path)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_queue(self, daily_quota=10000):
+        return UploadQueue(os.path.join(self.tmp.name, "queue.json"), daily_quota=daily_quota, now=self.clock)
+
+    async def test_defers_uploads_beyond_quota(self):
+        producer = MagicMock()
+        producer.aupload_to_youtube = AsyncMock(side_effect=["id1", "id2"])
+        scheduler = UploadScheduler(self.make_queue(daily_quota=3200), producer)
+        for path in self.videos[:3]:
+            scheduler.submit(path, {})
+        scheduler.close()
+
+        stats = await scheduler.run()
+        self.assertEqual(stats, {"uploaded": 2, "failed": 0, "timed_out": 0, "deferred": 1})
+        self.assertEqual(producer.aupload_to_youtube.await_count, 2)
+
+        # The deferred upload goes out once the quota has reset
+        self.clock.now = datetime(2026, 10, 20, 9, 0, tzinfo=QUOTA_TIMEZONE)
+        producer.aupload_to_youtube = AsyncMock(return_value="id3")
+        scheduler = UploadScheduler(self.make_queue(daily_quota=3200), producer)
+        scheduler.close()
+        stats = await scheduler.run()
+        self.assertEqual(stats["uploaded"], 1)
+        producer.aupload_to_youtube.assert_awaited_once_with(self.videos[2], {}, on_session=ANY, session_uri=None)
+
+    async def test_quota_error_stops_further_calls(self):
+        producer = MagicMock()
+        producer.aupload_to_youtube = AsyncMock(side_effect=QuotaError())
+        queue = self.make_queue()
+        scheduler = UploadScheduler(queue, producer)
+        scheduler.submit(self.videos[0], {})
+        scheduler.submit(self.videos[1], {})
+        scheduler.close()
+
+        stats = await scheduler.run()
+        self.assertEqual(stats["deferred"], 2)
+        producer.aupload_to_youtube.assert_awaited_once()
+        self.assertEqual(queue.next_job()["attempts"], 0)
+
+    async def test_failures_retry_then_give_up(self):
+        producer = MagicMock()
+        producer.aupload_to_youtube = AsyncMock(side_effect=RuntimeError("network"))
+        queue = self.make_queue()
+        scheduler = UploadScheduler(queue, producer, max_attempts=2, retry_delay=0)
+        scheduler.submit(self.videos[0], {})
+        scheduler.submit(os.path.join(self.tmp.name, "missing.mp4"), {})
+        scheduler.close()
+
+        stats = await scheduler.run()
+        self.assertEqual(stats["failed"], 2)
+        # The missing file never reached the API
+        self.assertEqual(producer.aupload_to_youtube.await_count, 2)
+
+    async def test_permanent_errors_are_not_retried(self):
+        producer = MagicMock()
+        producer.aupload_to_youtube = AsyncMock(side_effect=HttpError(400))
+        queue = self.make_queue()
+        scheduler = UploadScheduler(queue, producer, retry_delay=0)
+        scheduler.submit(self.videos[0], {})
+        scheduler.close()
+
+        stats = await scheduler.run()
+        self.assertEqual(stats["failed"], 1)
+        producer.aupload_to_youtube.assert_awaited_once()
+        # The API rejected the insert, which still costs quota
+        self.assertEqual(queue.remaining(), 10000 - 1600)
+
+    async def test_rate_limited_upload_is_retried_uncharged(self):
+        for reason in ("rateLimitExceeded", "userRateLimitExceeded"):
+            producer = MagicMock()
+            producer.aupload_to_youtube = AsyncMock(side_effect=[ReasonError(403, reason), "id1"])
+            queue = UploadQueue(os.path.join(self.tmp.name, f"{reason}.json"), now=self.clock)
+            scheduler = UploadScheduler(queue, producer, retry_delay=0)
+            scheduler.submit(self.videos[0], {})
+            scheduler.close()
+
+            stats = await scheduler.run()
+            self.assertEqual((stats["uploaded"], stats["failed"]), (1, 0), reason)
+            self.assertEqual(queue.remaining(), 10000 - 1600, reason)
+
+    async def test_upload_limit_defers_until_reset(self):
+        producer = MagicMock()
+        producer.aupload_to_youtube = AsyncMock(side_effect=ReasonError(400, "uploadLimitExceeded"))
+        queue = self.make_queue()
+        scheduler = UploadScheduler(queue, producer, retry_delay=0)
+        scheduler.submit(self.videos[0], {})
+        scheduler.submit(self.videos[1], {})
+        scheduler.close()
+
+        stats = await scheduler.run()
+        self.assertEqual((stats["deferred"], stats["failed"]), (2, 0))
+        producer.aupload_to_youtube.assert_awaited_once()
+        self.assertEqual(queue.remaining(), 0)
+        self.assertEqual(queue.next_job()["attempts"], 0)
+
+    async def test_quota_is_charged_only_once_the_api_was_reached(self):
+        async def upload(video_path, metadata, on_session, session_uri):
+            if producer.aupload_to_youtube.await_count == 1:
+                raise ConnectionResetError("before the insert reached YouTube")
+            on_session("https://upload/session")
+            raise ConnectionResetError("mid-upload")
+
+        producer = MagicMock()
+        producer.aupload_to_youtube = AsyncMock(side_effect=upload)
+        queue = self.make_queue()
+        scheduler = UploadScheduler(queue, producer, max_attempts=2, retry_delay=0)
+        scheduler.submit(self.videos[0], {})
+        scheduler.close()
+
+        await scheduler.run()
+        self.assertEqual(producer.aupload_to_youtube.await_count, 2)
+        self.assertEqual(queue.remaining(), 10000 - 1600)
+
+    async def test_timed_out_upload_resumes_its_session(self):
+        async def upload(video_path, metadata, on_session, session_uri):
+            if session_uri is None:
+                on_session("https://upload/session")
+                await asyncio.sleep(3600)
+            return "id1"
+
+        producer = MagicMock()
+        producer.aupload_to_youtube = AsyncMock(side_effect=upload)
+        queue = self.make_queue()
+        scheduler = UploadScheduler(queue, producer, retry_delay=0, timeouts={"upload": 0.05})
+        scheduler.submit(self.videos[0], {})
+        scheduler.close()
+
+        stats = await scheduler.run()
+        self.assertEqual((stats["timed_out"], stats["uploaded"]), (1, 1))
+        self.assertEqual(producer.aupload_to_youtube.await_args.kwargs["session_uri"], "https://upload/session")
+        # One insert, charged once
+        self.assertEqual(queue.remaining(), 10000 - 1600)
+
+    async def test_expired_session_starts_a_new_upload(self):
+        producer = MagicMock()
+        producer.aupload_to_youtube = AsyncMock(side_effect=[HttpError(404), "id1"])
+        queue = self.make_queue()
+        job = queue.enqueue(self.videos[0], {})
+        queue.update(job, upload_session="https://upload/expired")
+        scheduler = UploadScheduler(queue, producer, retry_delay=0)
+        scheduler.close()
+
+        stats = await scheduler.run()
+        self.assertEqual(stats["uploaded"], 1)
+        self.assertIsNone(producer.aupload_to_youtube.await_args.kwargs["session_uri"])
+        self.assertEqual(job["attempts"], 1)
+
+    async def test_retries_back_off(self):
+        producer = MagicMock()
+        producer.aupload_to_youtube = AsyncMock(side_effect=[RuntimeError("network"), "id1"])
+        scheduler = UploadScheduler(self.make_queue(), producer, retry_delay=0.2)
+        scheduler.submit(self.videos[0], {})
+        scheduler.close()
+
+        start = time.monotonic()
+        stats = await scheduler.run()
+        self.assertEqual(stats["uploaded"], 1)
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+    async def test_upload_timeout_is_a_distinct_outcome(self):
+        async def hang(video_path, metadata, on_session, session_uri):
+            await asyncio.sleep(3600)
+
+        producer = MagicMock()
+        producer.aupload_to_youtube = AsyncMock(side_effect=hang)
+        queue = self.make_queue()
+        scheduler = UploadScheduler(queue, producer, max_attempts=1, timeouts={"upload": 0.01})
+        scheduler.submit(self.videos[0], {})
+        scheduler.close()
+
+        stats = await scheduler.run()
+        self.assertEqual((stats["timed_out"], stats["failed"]), (1, 0))
+        self.assertEqual(queue.jobs[0]["status"], "timeout")
+
+    async def test_uploads_overlap_with_submissions(self):
+        producer = MagicMock()
+        producer.aupload_to_youtube = AsyncMock(side_effect=["id1", "id2"])
+        scheduler = UploadScheduler(self.make_queue(), producer)
+        task = asyncio.ensure_future(scheduler.run())
+
+        scheduler.submit(self.videos[0], {})
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        self.assertEqual(producer.aupload_to_youtube.await_count, 1)
+
+        scheduler.submit(self.videos[1], {})
+        scheduler.close()
+        stats = await task
+        self.assertEqual(stats["uploaded"], 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
 import unittest
-from unittest.mock import MagicMock
-from hymn_remaker.src.utils import retry_request
+import os
+import tempfile
+import httpx
+from unittest.mock import MagicMock, AsyncMock
+from hymn_remaker.src.utils import retry_request, async_retry_request, stream_to_file, async_download
 
 class TestUtils(unittest.TestCase):
     def test_retry_success(self):
@@ -36,5 +39,57 @@ class TestUtils(unittest.TestCase):
         # Called once + 2 retries = 3 calls
         self.assertEqual(mock_func.call_count, 3)
 
+    def test_stream_to_file(self):
+        response = MagicMock()
+        response.iter_content.return_value = [b"abc", b"de"]
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            written = stream_to_file(response, path, chunk_size=3)
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), b"abcde")
+        finally:
+            os.remove(path)
+
+        self.assertEqual(written, 5)
+        response.raise_for_status.assert_called_once()
+        response.iter_content.assert_called_once_with(chunk_size=3)
+        response.close.assert_called_once()
+
+class TestAsyncUtils(unittest.IsolatedAsyncioTestCase):
+    async def test_async_retry_fail_then_success(self):
+        mock_func = AsyncMock(side_effect=[Exception("fail1"), "success"])
+        mock_func.__name__ = "mock_func"
+        decorated = async_retry_request(max_retries=2, delay=0)(mock_func)
+
+        self.assertEqual(await decorated(), "success")
+        self.assertEqual(mock_func.await_count, 2)
+
+    async def test_async_retry_fail_max(self):
+        mock_func = AsyncMock(side_effect=Exception("fail"))
+        mock_func.__name__ = "mock_func"
+        decorated = async_retry_request(max_retries=1, delay=0)(mock_func)
+
+        with self.assertRaises(Exception):
+            await decorated()
+        self.assertEqual(mock_func.await_count, 2)
+
+    async def test_async_download(self):
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, content=b"x" * 3000))
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            async with httpx.AsyncClient(transport=transport) as client:
+                written = await async_download("http://example.com/a.wav", path, client=client, chunk_size=1024)
+            self.assertEqual(written, 3000)
+            self.assertEqual(os.path.getsize(path), 3000)
+
+            transport = httpx.MockTransport(lambda request: httpx.Response(404))
+            async with httpx.AsyncClient(transport=transport) as client:
+                with self.assertRaises(httpx.HTTPStatusError):
+                    await async_download("http://example.com/missing", path, client=client)
+        finally:
+            os.remove(path)
+
 if __name__ == '__main__':
     unittest.main()
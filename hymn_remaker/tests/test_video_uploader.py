@@ -1,11 +1,13 @@
 import unittest
 import os
 import sys
-from unittest.mock import patch, MagicMock
+import subprocess
+from unittest.mock import patch, MagicMock, AsyncMock
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
 from hymn_remaker.src.video_uploader import VideoProducer
+from hymn_remaker.src.timeouts import HTTP_TIMEOUT
 
 class TestVideoProducer(unittest.TestCase):
     def setUp(self):
@@ -19,12 +21,35 @@ class TestVideoProducer(unittest.TestCase):
         if os.path.exists("test_video.mp4"):
             os.remove("test_video.mp4")
 
+    @patch('hymn_remaker.src.video_uploader.MediaFileUpload')
+    def test_upload_reports_and_resumes_sessions(self, mock_media):
+        producer = VideoProducer()
+        producer.youtube = MagicMock()
+        request = producer.youtube.videos.return_value.insert.return_value
+        request.resumable_uri = None
+
+        def next_chunk():
+            request.resumable_uri = "https://upload/session"
+            return None, {"id": "vid"}
+
+        request.next_chunk.side_effect = next_chunk
+        sessions = []
+        self.assertEqual(producer.upload_to_youtube(self.test_audio, {}, on_session=sessions.append), "vid")
+        self.assertEqual(sessions, ["https://upload/session"])
+
+        # A retry resumes the session instead of inserting a second copy
+        request.next_chunk.side_effect = None
+        request.next_chunk.return_value = (None, {"id": "vid"})
+        producer.upload_to_youtube(self.test_audio, {}, session_uri="https://upload/old")
+        self.assertEqual(request.resumable_uri, "https://upload/old")
+        self.assertTrue(request._in_error_state)
+
     @patch('hymn_remaker.src.video_uploader.requests.get')
     @patch('hymn_remaker.src.video_uploader.subprocess.run')
     def test_create_video(self, mock_subprocess, mock_get):
         # Mock requests.get
         mock_response = MagicMock()
-        mock_response.content = b"fake image content"
+        mock_response.iter_content.return_value = [b"fake image content"]
         mock_get.return_value = mock_response
 
         producer = VideoProducer()
@@ -32,13 +57,54 @@ class TestVideoProducer(unittest.TestCase):
 
         producer.create_video(self.test_audio, "http://image.url", output_path)
 
-        mock_get.assert_called_with("http://image.url")
+        mock_get.assert_called_with("http://image.url", stream=True, timeout=HTTP_TIMEOUT)
         mock_subprocess.assert_called_once()
 
         cmd = mock_subprocess.call_args[0][0]
         self.assertEqual(cmd[0], "ffmpeg")
         self.assertIn("-loop", cmd)
         self.assertIn("-shortest", cmd)
+        self.assertEqual(cmd[cmd.index("-c:a") + 1], "aac")
+
+    @patch('hymn_remaker.src.video_uploader.requests.get')
+    @patch('hymn_remaker.src.video_uploader.subprocess.run')
+    def test_create_video_copy_audio(self, mock_subprocess, mock_get):
+        mock_get.return_value = MagicMock(content=b"fake image content")
+
+        producer = VideoProducer()
+        producer.create_video(self.test_audio, "http://image.url", "test_video.mp4", copy_audio=True)
+
+        cmd = mock_subprocess.call_args[0][0]
+        self.assertEqual(cmd[cmd.index("-c:a") + 1], "copy")
+        self.assertNotIn("-b:a", cmd)
+
+class TestVideoProducerAsync(unittest.IsolatedAsyncioTestCase):
+    @patch('hymn_remaker.src.video_uploader.async_download', new_callable=AsyncMock)
+    @patch('hymn_remaker.src.video_uploader.asyncio.create_subprocess_exec', new_callable=AsyncMock)
+    async def test_acreate_video(self, mock_exec, mock_download):
+        process = mock_exec.return_value
+        process.communicate = AsyncMock(return_value=(None, b""))
+        process.returncode = 0
+
+        producer = VideoProducer()
+        await producer.acreate_video("audio.m4a", "http://image.url", "out.mp4", copy_audio=True)
+
+        self.assertEqual(mock_download.call_args[0][0], "http://image.url")
+        cmd = mock_exec.call_args[0]
+        self.assertEqual(cmd[0], "ffmpeg")
+        self.assertEqual(cmd[cmd.index("-c:a") + 1], "copy")
+        self.assertEqual(cmd[-1], "out.mp4")
+
+    @patch('hymn_remaker.src.video_uploader.async_download', new_callable=AsyncMock)
+    @patch('hymn_remaker.src.video_uploader.asyncio.create_subprocess_exec', new_callable=AsyncMock)
+    async def test_acreate_video_ffmpeg_failure(self, mock_exec, mock_download):
+        process = mock_exec.return_value
+        process.communicate = AsyncMock(return_value=(None, b"Invalid data found"))
+        process.returncode = 1
+
+        producer = VideoProducer()
+        with self.assertRaises(subprocess.CalledProcessError):
+            await producer.acreate_video("audio.m4a", "http://image.url", "out.mp4")
 
 if __name__ == '__main__':
     unittest.main()